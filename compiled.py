@@ -0,0 +1,448 @@
+import collections
+import json
+import os
+
+import numpy
+
+import hetnet
+
+
+class CompiledGraph(object):
+    """
+    Frozen, integer-indexed view of a Graph. The nodes of each metanode are
+    mapped to dense integers (in sorted id order) and the edges of each
+    metaedge are stored as compressed sparse row (CSR) adjacency: for the
+    source node with index i, the targets are indices[indptr[i]:indptr[i + 1]].
+    Metanodes are keyed by kind and metaedges by their id tuple, so a
+    metapath from any equivalent MetaGraph can be used to query the view.
+
+    The degrees are a snapshot of the graph when compiled which ignores its
+    masks, so the degree-weighted methods equal their pathtools equivalents
+    called with exclude_masked=False, or on a graph without masks. Only the
+    path methods with masked=False consult the masks of the source graph.
+    """
+
+    def __init__(self, metagraph, node_ids, indptr, indices, nodes=None, edges=None, graph=None,
+                 degree_dict=None):
+        """
+        node_ids maps metanode kind to a list of node ids. indptr and indices
+        map metaedge id to numpy arrays. nodes and edges, which map to lists
+        of Node and Edge objects aligned with node_ids and indices, and graph
+        are only available when compiled from a Graph. degree_dict maps
+        metaedge id to degree arrays and defaults to the CSR row lengths.
+        """
+        self.graph = graph
+        self.metagraph = metagraph
+        self.node_ids = node_ids
+        self.node_index = {kind: {id_: i for i, id_ in enumerate(ids)}
+                           for kind, ids in node_ids.iteritems()}
+        self.indptr = indptr
+        self.indices = indices
+        self.nodes = nodes
+        self.edges = edges
+        if degree_dict is None:
+            degree_dict = {metaedge_id: numpy.diff(ptr)
+                           for metaedge_id, ptr in indptr.iteritems()}
+        self.degree_dict = degree_dict
+        # storage for derived matrices computed by the matrix module
+        self.matrix_cache = dict()
+
+    @staticmethod
+    def from_graph(graph):
+        """Compile graph into CSR adjacency, one matrix per metaedge."""
+        metanode_to_nodes = graph.get_metanode_to_nodes()
+        node_ids, nodes = dict(), dict()
+        for kind, metanode in graph.metagraph.node_dict.iteritems():
+            node_list = sorted(metanode_to_nodes.get(metanode, list()))
+            nodes[kind] = node_list
+            node_ids[kind] = [node.id_ for node in node_list]
+
+        indptr, indices, edges = dict(), dict(), dict()
+        for metaedge in graph.metagraph.get_edges(exclude_inverts=False):
+            metaedge_id = metaedge.get_id()
+            source_nodes = nodes[metaedge.source.id_]
+            target_index = {node: i for i, node in enumerate(nodes[metaedge.target.id_])}
+            ptr = numpy.zeros(len(source_nodes) + 1, dtype=numpy.int64)
+            target_list, edge_list = list(), list()
+            for i, node in enumerate(source_nodes):
+                node_edges = [(target_index[edge.target], edge) for edge in node.edges[metaedge]]
+                node_edges.sort(key=lambda item: item[0])
+                target_list.extend(item[0] for item in node_edges)
+                edge_list.extend(item[1] for item in node_edges)
+                ptr[i + 1] = len(target_list)
+            indptr[metaedge_id] = ptr
+            indices[metaedge_id] = numpy.array(target_list, dtype=numpy.int32)
+            edges[metaedge_id] = edge_list
+
+        compiled = CompiledGraph(graph.metagraph, node_ids, indptr, indices, nodes, edges, graph)
+        # edges missing from a subgraph still count towards degrees
+        for (node, metaedge), offset in graph.degree_index.offsets.iteritems():
+            index = compiled.node_index[metaedge.source.id_][node.id_]
+            compiled.degree_dict[metaedge.get_id()][index] += offset
+        return compiled
+
+    def save(self, directory):
+        """
+        Write the arrays to directory as .npy files alongside a JSON file of
+        the node ids and metaedges, so that load can memory-map them.
+        """
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        metaedge_tuples = [metaedge.get_id() for metaedge in self.metagraph.get_edges()]
+        metaedge_ids = sorted(self.indptr)
+        for i, metaedge_id in enumerate(metaedge_ids):
+            for name, arrays in ('indptr', self.indptr), ('indices', self.indices), ('degrees', self.degree_dict):
+                path = os.path.join(directory, '{}-{}.npy'.format(name, i))
+                numpy.save(path, arrays[metaedge_id])
+        metadata = {'metaedge_tuples': metaedge_tuples,
+                    'metaedge_ids': metaedge_ids,
+                    'node_ids': self.node_ids}
+        with open(os.path.join(directory, 'compiled.json'), 'w') as write_file:
+            json.dump(metadata, write_file)
+
+    @staticmethod
+    def load(directory, mmap_mode='r'):
+        """
+        Read a CompiledGraph written by save. With the default mmap_mode the
+        arrays are memory-mapped read-only, so processes loading the same
+        directory share their pages rather than each holding a copy.
+        """
+        with open(os.path.join(directory, 'compiled.json')) as read_file:
+            metadata = json.load(read_file)
+        metaedge_tuples = [tuple(str(x) for x in metaedge_tuple)
+                           for metaedge_tuple in metadata['metaedge_tuples']]
+        metagraph = hetnet.MetaGraph.from_edge_tuples(metaedge_tuples)
+        node_ids = {str(kind): ids for kind, ids in metadata['node_ids'].iteritems()}
+        indptr, indices, degree_dict = dict(), dict(), dict()
+        for i, metaedge_id in enumerate(metadata['metaedge_ids']):
+            metaedge_id = tuple(str(x) for x in metaedge_id)
+            for name, arrays in ('indptr', indptr), ('indices', indices), ('degrees', degree_dict):
+                path = os.path.join(directory, '{}-{}.npy'.format(name, i))
+                # a plain ndarray view of the memmap avoids its slicing overhead
+                arrays[metaedge_id] = numpy.asarray(numpy.load(path, mmap_mode=mmap_mode))
+        return CompiledGraph(metagraph, node_ids, indptr, indices, degree_dict=degree_dict)
+
+    def get_index(self, node, kind):
+        """Return the integer index of node (a Node or node id) of metanode kind."""
+        if isinstance(node, hetnet.Node):
+            node = node.id_
+        return self.node_index[kind][node]
+
+    def get_node(self, kind, index):
+        """Return the Node object at index for metanode kind."""
+        return self.nodes[kind][index]
+
+    def get_edge(self, metaedge_id, position):
+        """Return the Edge object stored at a CSR position of a metaedge."""
+        return self.edges[metaedge_id][position]
+
+    def degrees(self, metaedge):
+        """
+        Return the array of source-node degrees for metaedge. For a compiled
+        subgraph these include edges absent from the subgraph, so use indptr
+        for the number of stored edges.
+        """
+        return self.degree_dict[metaedge.get_id()]
+
+    def neighbors(self, metaedge, index):
+        """Return the target indices adjacent to source index along metaedge."""
+        metaedge_id = metaedge.get_id()
+        ptr = self.indptr[metaedge_id]
+        return self.indices[metaedge_id][ptr[index]:ptr[index + 1]]
+
+    def masked_positions(self, metaedge_id):
+        """
+        Return a boolean array over the CSR positions of metaedge_id which is
+        True where the edge or its target node is masked in the source graph.
+        """
+        graph = self.graph
+        edges = self.edges[metaedge_id]
+        edge_mask = graph.edge_mask.to_array(len(graph.edge_list))
+        node_mask = graph.node_mask.to_array(len(graph.node_list))
+        edge_ids = numpy.fromiter((edge.int_id for edge in edges), dtype=numpy.int64, count=len(edges))
+        target_ids = numpy.fromiter((edge.target.int_id for edge in edges), dtype=numpy.int64, count=len(edges))
+        return edge_mask[edge_ids] | node_mask[target_ids]
+
+    def edge_key(self, edge):
+        """Return the (metaedge id, source index, target index) of an Edge."""
+        metaedge = edge.metaedge
+        source_index = self.node_index[metaedge.source.id_][edge.source.id_]
+        target_index = self.node_index[metaedge.target.id_][edge.target.id_]
+        return metaedge.get_id(), source_index, target_index
+
+    def iter_index_paths(self, source, metapath, adjacent_duplicates=False,
+                         exclude_nodes=set(), exclude_edges=set(), masked=True,
+                         duplicates=False):
+        """
+        Iterative depth-first search over the CSR adjacency. source is an
+        integer index. Yields (nodes, positions) tuples where nodes are the
+        indices of the path nodes and positions are the CSR positions of the
+        path edges. Paths with repeated nodes are excluded, except that
+        adjacent_duplicates permits consecutive repeats (self-loops) as
+        pathtools.crdfs_paths_from does and duplicates permits all repeats.
+        exclude_nodes and exclude_edges are sets of Node and Edge objects.
+        Setting masked False excludes paths through masked nodes or edges.
+        """
+        metaedge_ids = [metaedge.get_id() for metaedge in metapath]
+        kinds = [metapath[0].source.id_] + [metaedge.target.id_ for metaedge in metapath]
+        length = len(metaedge_ids)
+        gap = 2 if adjacent_duplicates else 1
+
+        # positions of earlier nodes that the node at each depth must differ from
+        forbidden = [[k for k in range(depth + 2 - gap) if kinds[k] == kinds[depth + 1]]
+                     if not duplicates else list() for depth in range(length)]
+
+        excluded_nodes = collections.defaultdict(set)
+        for node in exclude_nodes:
+            index = self.node_index[node.metanode.id_].get(node.id_)
+            excluded_nodes[node.metanode.id_].add(index)
+        excluded_nodes = [excluded_nodes.get(kind, set()) for kind in kinds]
+        if source in excluded_nodes[0]:
+            return
+
+        excluded_pairs = collections.defaultdict(set)
+        for edge in exclude_edges:
+            metaedge_id, source_index, target_index = self.edge_key(edge)
+            excluded_pairs[metaedge_id].add((source_index, target_index))
+        excluded_pairs = [excluded_pairs.get(metaedge_id, set()) for metaedge_id in metaedge_ids]
+
+        blocked = None
+        if not masked and self.graph is not None and self.graph.has_masked():
+            blocked = [self.masked_positions(metaedge_id).tolist() for metaedge_id in metaedge_ids]
+
+        nodes = [source] + [None] * length
+        positions = [None] * length
+        iterators = [None] * length
+
+        def expand(depth):
+            metaedge_id = metaedge_ids[depth]
+            ptr = self.indptr[metaedge_id]
+            start, stop = int(ptr[nodes[depth]]), int(ptr[nodes[depth] + 1])
+            targets = self.indices[metaedge_id][start:stop].tolist()
+            return enumerate(targets, start)
+
+        depth = 0
+        iterators[0] = expand(0)
+        while depth >= 0:
+            for position, target in iterators[depth]:
+                if any(nodes[k] == target for k in forbidden[depth]):
+                    continue
+                if target in excluded_nodes[depth + 1]:
+                    continue
+                if (nodes[depth], target) in excluded_pairs[depth]:
+                    continue
+                if blocked is not None and blocked[depth][position]:
+                    continue
+                nodes[depth + 1] = target
+                positions[depth] = position
+                if depth + 1 == length:
+                    yield tuple(nodes), tuple(positions)
+                    continue
+                depth += 1
+                iterators[depth] = expand(depth)
+                break
+            else:
+                depth -= 1
+
+    def edges_from_positions(self, metapath, positions):
+        """Convert the CSR positions of a path into a tuple of Edge objects."""
+        return tuple(self.edges[metaedge.get_id()][position]
+                     for metaedge, position in zip(metapath, positions))
+
+    def paths_from(self, source, metapath,
+                   duplicates=False, masked=True,
+                   exclude_nodes=set(), exclude_edges=set()):
+        """
+        Equivalent of Graph.paths_from evaluated on the compiled adjacency.
+        Returns a list of Paths or None if source is masked or excluded.
+        """
+        if not metapath:
+            return list()
+        kind = metapath[0].source.id_
+        source_index = self.get_index(source, kind)
+        source_node = self.nodes[kind][source_index]
+        if (masked and source_node.masked) or source_node in exclude_nodes:
+            return None
+        paths = list()
+        for nodes, positions in self.iter_index_paths(
+                source_index, metapath, False, exclude_nodes, exclude_edges, masked, duplicates):
+            paths.append(hetnet.Path(self.edges_from_positions(metapath, positions)))
+        return paths
+
+    def paths_between(self, source, target, metapath,
+                      duplicates=False, masked=True,
+                      exclude_nodes=set(), exclude_edges=set()):
+        """Equivalent of Graph.paths_between evaluated on the compiled adjacency."""
+        target_index = self.get_index(target, metapath[-1].target.id_)
+        paths = self.paths_from(source, metapath, duplicates, masked,
+                                exclude_nodes, exclude_edges) or list()
+        target_node = self.nodes[metapath[-1].target.id_][target_index]
+        return [path for path in paths if path.target() is target_node]
+
+    def crdfs_paths_from(self, node, metapath):
+        """
+        Equivalent of pathtools.crdfs_paths_from: returns a tuple of paths,
+        each a tuple of Edge objects, from node following metapath.
+        """
+        if not metapath:
+            return tuple(),
+        source_index = self.get_index(node, metapath[0].source.id_)
+        return tuple(self.edges_from_positions(metapath, positions)
+                     for nodes, positions in self.iter_index_paths(
+                         source_index, metapath, adjacent_duplicates=True))
+
+    def crdfs_paths_fromto(self, source_node, target_node, metapath,
+                           exclude_nodes=set(), exclude_edges=set()):
+        """Equivalent of pathtools.crdfs_paths_fromto. Returns a tuple of Paths."""
+        source_index = self.get_index(source_node, metapath[0].source.id_)
+        target_index = self.get_index(target_node, metapath[-1].target.id_)
+        paths = list()
+        for nodes, positions in self.iter_index_paths(
+                source_index, metapath, True, exclude_nodes, exclude_edges):
+            if nodes[-1] != target_index:
+                continue
+            paths.append(hetnet.Path(self.edges_from_positions(metapath, positions)))
+        return tuple(paths)
+
+    def degree_adjustments(self, exclude_edges):
+        """
+        Return a dict of (metaedge id, source index) to the number of
+        exclude_edges incident to that node along that metaedge.
+        """
+        adjustments = collections.Counter()
+        for edge in exclude_edges:
+            metaedge_id, source_index, target_index = self.edge_key(edge)
+            adjustments[metaedge_id, source_index] += 1
+        return adjustments
+
+    def path_degree_product(self, path, damping_exponent, exclude_edges=set()):
+        """
+        Equivalent of pathtools.path_degree_product with exclude_masked=False,
+        using CSR degrees.
+        """
+        adjustments = self.degree_adjustments(exclude_edges) if exclude_edges else dict()
+        return self._degree_product(path, damping_exponent, adjustments)
+
+    def _degree_product(self, path, damping_exponent, adjustments):
+        degree_product = 1.0
+        for edge in path:
+            metaedge_id, source_index, target_index = self.edge_key(edge)
+            inverse_id = edge.metaedge.inverse.get_id()
+            source_degree = self.degree_dict[metaedge_id][source_index]
+            source_degree -= adjustments.get((metaedge_id, source_index), 0)
+            target_degree = self.degree_dict[inverse_id][target_index]
+            target_degree -= adjustments.get((inverse_id, target_index), 0)
+            degree_product *= float(source_degree) ** damping_exponent
+            degree_product *= float(target_degree) ** damping_exponent
+        return degree_product
+
+    def degree_weighted_path_count(self, paths, damping_exponent, exclude_edges=set()):
+        """
+        Equivalent of pathtools.degree_weighted_path_count with
+        exclude_masked=False, using CSR degrees.
+        """
+        adjustments = self.degree_adjustments(exclude_edges) if exclude_edges else dict()
+        return sum(1.0 / self._degree_product(path, damping_exponent, adjustments)
+                   for path in paths)
+
+    def has_edge(self, metaedge_id, source_index, target_index):
+        """Return whether source_index and target_index are adjacent along metaedge_id."""
+        ptr = self.indptr[metaedge_id]
+        start, stop = int(ptr[source_index]), int(ptr[source_index + 1])
+        targets = self.indices[metaedge_id]
+        position = start + int(numpy.searchsorted(targets[start:stop], target_index))
+        return position < stop and targets[position] == target_index
+
+    def aggregate_paths(self, source, target, metapath, damping_exponent=None,
+                        exclude_pairs=set()):
+        """
+        Equivalent of pathtools._aggregate_paths with exclude_masked=False on
+        the compiled adjacency, needing only the arrays so that it runs on a
+        loaded CompiledGraph.
+        source and target are integer indices and target may be None.
+        exclude_pairs is a set of (metaedge id, source index, target index)
+        edges to exclude, which should list both directions of each edge.
+        Masking is not applied. Returns a (path count, DWPC) tuple, where
+        the DWPC is an array for a sequence of damping exponents.
+        """
+        exponents = None
+        if damping_exponent is not None and not numpy.isscalar(damping_exponent):
+            damping_exponent = exponents = numpy.array(damping_exponent, dtype=numpy.float64)
+        metaedge_ids = [metaedge.get_id() for metaedge in metapath]
+        inverse_ids = [metaedge.inverse.get_id() for metaedge in metapath]
+        kinds = [metapath[0].source.id_] + [metaedge.target.id_ for metaedge in metapath]
+        length = len(metaedge_ids)
+
+        # as in crdfs_paths_from, a node may repeat at the next position
+        forbidden = [[k for k in range(depth) if kinds[k] == kinds[depth + 1]]
+                     for depth in range(length)]
+        relevant = [tuple(k for k in range(depth) if any(
+                    kinds[j] == kinds[k] for j in range(max(depth + 1, k + 2), length + 1)))
+                    for depth in range(length + 1)]
+
+        excluded = [set() for depth in range(length)]
+        adjustments = collections.Counter()
+        for metaedge_id, source_index, target_index in exclude_pairs:
+            adjustments[metaedge_id, source_index] += 1
+            for depth, depth_id in enumerate(metaedge_ids):
+                if depth_id == metaedge_id:
+                    excluded[depth].add((source_index, target_index))
+
+        degrees = dict()
+        # the nodes from which the final metaedge reaches target, with the
+        # number of such edges, as a self-loop is listed in both directions
+        last_sources = None
+        if target is not None:
+            ptr = self.indptr[inverse_ids[-1]]
+            last_sources = collections.Counter(
+                self.indices[inverse_ids[-1]][int(ptr[target]):int(ptr[target + 1])].tolist())
+
+        def degree(metaedge_id, index):
+            try:
+                return degrees[metaedge_id, index]
+            except KeyError:
+                degree = int(self.degree_dict[metaedge_id][index])
+                degree -= adjustments.get((metaedge_id, index), 0)
+                degrees[metaedge_id, index] = degree
+                return degree
+
+        memo = dict()
+        def aggregate(nodes):
+            depth = len(nodes) - 1
+            if depth == length:
+                return 1, 1.0
+            node = nodes[-1]
+            key = (node, depth) + tuple(nodes[k] for k in relevant[depth])
+            try:
+                return memo[key]
+            except KeyError:
+                pass
+            metaedge_id = metaedge_ids[depth]
+            if last_sources is not None and depth + 1 == length:
+                targets = [target] * last_sources[node]
+            else:
+                ptr = self.indptr[metaedge_id]
+                targets = self.indices[metaedge_id][int(ptr[node]):int(ptr[node + 1])].tolist()
+            count, weight = 0, 0.0
+            for edge_target in targets:
+                if any(nodes[k] == edge_target for k in forbidden[depth]):
+                    continue
+                if (node, edge_target) in excluded[depth]:
+                    continue
+                tail_count, tail_weight = aggregate(nodes + (edge_target, ))
+                if not tail_count:
+                    continue
+                count += tail_count
+                if damping_exponent is not None:
+                    degree_product = (float(degree(metaedge_id, node)) ** damping_exponent *
+                                      float(degree(inverse_ids[depth], edge_target)) ** damping_exponent)
+                    weight += tail_weight / degree_product
+            memo[key] = count, weight
+            return count, weight
+
+        count, weight = aggregate((source, ))
+        if damping_exponent is None:
+            return count, None
+        if exponents is not None and not count:
+            weight = numpy.zeros(len(exponents))
+        return count, weight
@@ -4,30 +4,316 @@ import itertools
 import os
 import gzip
 import csv
-import time
+import hashlib
+import json
+import multiprocessing
+import shutil
+import tempfile
+
+import numpy
 
 import hetio
+import compiled
+import instrumentation
+import pathcache
 import pathtools
 import readwrite
 
-def compute_features(graph, part_rows, feature_path, dwpc_exponent):
+class FeatureWriter(object):
+    """
+    Writes feature rows to a gzipped TSV in checkpoints. Every
+    checkpoint_rows rows the current gzip member is closed, so that the
+    file holds only complete members, and a sidecar manifest records the
+    number of rows and bytes written. With resume, writing continues after
+    the last checkpoint of an earlier run: the file is truncated to the
+    checkpointed bytes and completed is the number of rows to skip.
+
+    settings, a JSON-serializable dict of the run settings which determine
+    the rows written, such as their order, is stored in the manifest. A run
+    only resumes if its settings and fieldnames match those of the manifest
+    and the file holds the checkpointed bytes, raising ValueError otherwise.
+    """
+
+    def __init__(self, feature_path, checkpoint_rows=100, resume=False, settings=None):
+        self.feature_path = feature_path
+        self.manifest_path = feature_path + '.manifest.json'
+        self.checkpoint_rows = checkpoint_rows
+        self.settings = settings
+        self.completed = 0
+        self.fieldnames = None
+        if resume and os.path.exists(self.manifest_path) and os.path.exists(feature_path):
+            manifest = read_manifest(self.manifest_path, settings)
+            if os.path.getsize(feature_path) < manifest['bytes']:
+                raise ValueError('cannot resume: {} is shorter than its manifest records'.format(
+                    feature_path))
+            self.completed = manifest['rows']
+            self.fieldnames = manifest['fieldnames']
+            with open(feature_path, 'r+b') as feature_file:
+                feature_file.truncate(manifest['bytes'])
+            print 'resuming after {} rows'.format(self.completed)
+        else:
+            # a manifest of an earlier run must not describe the new file
+            if os.path.exists(self.manifest_path):
+                os.remove(self.manifest_path)
+            open(feature_path, 'wb').close()
+        self.pending = 0
+        self.feature_file = None
+        self.writer = None
+
+    def writerow(self, features):
+        if self.writer is None:
+            self.feature_file = gzip.open(self.feature_path, 'ab')
+            header = self.fieldnames is None
+            self.fieldnames = check_fieldnames(self.fieldnames, features)
+            self.writer = csv.DictWriter(self.feature_file, fieldnames=self.fieldnames, delimiter='\t')
+            if header:
+                self.writer.writeheader()
+        self.writer.writerow(features)
+        self.pending += 1
+        if self.pending >= self.checkpoint_rows:
+            self.checkpoint()
+
+    def checkpoint(self, complete=False):
+        """Close the current gzip member and record progress in the manifest."""
+        if self.feature_file is not None:
+            self.feature_file.close()
+            self.feature_file = None
+            self.writer = None
+        self.completed += self.pending
+        self.pending = 0
+        manifest = {'rows': self.completed,
+                    'bytes': os.path.getsize(self.feature_path),
+                    'fieldnames': self.fieldnames,
+                    'settings': self.settings,
+                    'complete': complete}
+        # replace the manifest atomically so a crash leaves the previous one
+        temp_path = self.manifest_path + '.tmp'
+        with open(temp_path, 'w') as write_file:
+            json.dump(manifest, write_file)
+        os.rename(temp_path, self.manifest_path)
+
+    def close(self):
+        self.checkpoint(complete=True)
+
+
+def read_manifest(manifest_path, settings):
+    """
+    Read the manifest of an earlier run, raising ValueError if it was
+    written with settings other than settings.
+    """
+    with open(manifest_path) as read_file:
+        manifest = json.load(read_file)
+    # compare through JSON, as the manifest holds lists rather than tuples
+    if manifest.get('settings') != json.loads(json.dumps(settings)):
+        raise ValueError('cannot resume: {} records settings {} rather than {}'.format(
+            manifest_path, manifest.get('settings'), settings))
+    return manifest
+
+def check_fieldnames(fieldnames, features):
+    """
+    Return the fieldnames of features, raising ValueError if they differ
+    from fieldnames, those already written, unless fieldnames is None.
+    """
+    if fieldnames is not None and list(fieldnames) != list(features.keys()):
+        raise ValueError('cannot resume: fieldnames differ from those already written')
+    return fieldnames or features.keys()
+
+
+# fields which identify a row, stored by ColumnarFeatureWriter as metadata
+# rather than as columns of the feature matrix
+metadata_fields = ('row_index', 'gene_code', 'gene_symbol', 'disease_code', 'disease_name',
+                   'status', 'status_int', 'percentile', 'part')
+
+class ColumnarFeatureWriter(object):
+    """
+    Writes feature rows to the directory feature_path as uncompressed .npz
+    chunks of checkpoint_rows rows. Each chunk holds a float64 matrix,
+    features, with a column per feature and an array per metadata field.
+    Missing features are stored as NaN. After each chunk, a manifest
+    listing the chunks and fieldnames is replaced atomically. Resuming
+    works as in FeatureWriter, removing any chunk not in the manifest.
+    """
+
+    def __init__(self, feature_path, checkpoint_rows=100, resume=False, settings=None):
+        self.feature_path = feature_path
+        self.manifest_path = os.path.join(feature_path, 'manifest.json')
+        self.checkpoint_rows = checkpoint_rows
+        self.settings = settings
+        self.completed = 0
+        self.fieldnames = None
+        self.chunks = list()
+        if not os.path.isdir(feature_path):
+            os.makedirs(feature_path)
+        if resume and os.path.exists(self.manifest_path):
+            manifest = read_manifest(self.manifest_path, settings)
+            for chunk in manifest['chunks']:
+                if not os.path.exists(os.path.join(feature_path, chunk['name'])):
+                    raise ValueError('cannot resume: {} is missing chunk {}'.format(
+                        feature_path, chunk['name']))
+            self.completed = manifest['rows']
+            self.fieldnames = manifest['fieldnames']
+            self.chunks = manifest['chunks']
+            print 'resuming after {} rows'.format(self.completed)
+        elif os.path.exists(self.manifest_path):
+            os.remove(self.manifest_path)
+        # remove chunks of an earlier run, or written after its last checkpoint
+        chunk_names = set(chunk['name'] for chunk in self.chunks)
+        for name in os.listdir(feature_path):
+            if name.endswith('.npz') and name not in chunk_names:
+                os.remove(os.path.join(feature_path, name))
+        self.rows = list()
+
+    def writerow(self, features):
+        if not self.rows:
+            self.fieldnames = check_fieldnames(self.fieldnames, features)
+        self.rows.append(features)
+        if len(self.rows) >= self.checkpoint_rows:
+            self.checkpoint()
+
+    def checkpoint(self, complete=False):
+        """Write the pending rows as a chunk and record it in the manifest."""
+        fieldnames = self.fieldnames or list()
+        feature_names = [field for field in fieldnames if field not in metadata_fields]
+        if self.rows:
+            name = 'chunk-{:06d}.npz'.format(len(self.chunks))
+            arrays = dict()
+            for field in fieldnames:
+                if field in metadata_fields:
+                    arrays[field] = numpy.array([row[field] for row in self.rows])
+            matrix = numpy.array([[numpy.nan if row[field] is None else row[field]
+                                   for field in feature_names] for row in self.rows],
+                                 dtype=numpy.float64)
+            arrays['features'] = matrix.reshape(len(self.rows), len(feature_names))
+            # numpy.savez appends .npz to paths lacking it, so keep the suffix
+            temp_path = os.path.join(self.feature_path, 'temp-' + name)
+            numpy.savez(temp_path, **arrays)
+            os.rename(temp_path, os.path.join(self.feature_path, name))
+            self.chunks.append({'name': name, 'rows': len(self.rows)})
+        self.completed += len(self.rows)
+        self.rows = list()
+        manifest = {'rows': self.completed,
+                    'chunks': self.chunks,
+                    'fieldnames': self.fieldnames,
+                    'feature_names': feature_names,
+                    'metadata_fields': [field for field in fieldnames if field in metadata_fields],
+                    'settings': self.settings,
+                    'complete': complete}
+        # replace the manifest atomically so a crash leaves the previous one
+        temp_path = self.manifest_path + '.tmp'
+        with open(temp_path, 'w') as write_file:
+            json.dump(manifest, write_file)
+        os.rename(temp_path, self.manifest_path)
+
+    def close(self):
+        self.checkpoint(complete=True)
+
+
+def read_columnar_features(feature_path):
+    """
+    Read the output of ColumnarFeatureWriter. Returns the feature names, the
+    float64 feature matrix and an OrderedDict of metadata field to array.
+    """
+    with open(os.path.join(feature_path, 'manifest.json')) as read_file:
+        manifest = json.load(read_file)
+    feature_names = manifest['feature_names']
+    matrices = list()
+    metadata = collections.OrderedDict((field, list()) for field in manifest['metadata_fields'])
+    for chunk in manifest['chunks']:
+        arrays = numpy.load(os.path.join(feature_path, chunk['name']))
+        matrices.append(arrays['features'])
+        for field, values in metadata.items():
+            values.append(arrays[field])
+        arrays.close()
+    if matrices:
+        features = numpy.concatenate(matrices)
+    else:
+        features = numpy.zeros((0, len(feature_names)))
+    for field, values in metadata.items():
+        metadata[field] = numpy.concatenate(values)
+    return feature_names, features, metadata
+
+# writers of compute_features output by feature_format
+feature_writers = {'tsv': FeatureWriter, 'npz': ColumnarFeatureWriter}
+
+
+def schedule_rows(part_rows, schedule=True):
+    """
+    Return a list of (row_index, part_row) in processing order. With
+    schedule, rows are grouped by disease and then gene, so consecutive rows
+    reuse the cached per-disease results of pathtools. Otherwise rows keep
+    their original order.
+    """
+    indexed_rows = list(enumerate(part_rows))
+    if schedule:
+        indexed_rows.sort(key=lambda item: (item[1]['disease_code'], item[1]['gene_symbol'], item[0]))
+    return indexed_rows
 
-    print('Initial Memory Usage: {:.1f}. Max Memory Usage: {:.1f}'.format(
-        hetnet.pathtools.memory_usage() / 1024.0, hetnet.pathtools.max_MB / 1024.0))
+def run_settings(indexed_rows, dwpc_exponent, max_length):
+    """
+    Return the settings which a resumed run must share with the run it
+    resumes: the exponents, the maximum metapath length and a digest of the
+    rows in processing order, which reflects the partition and schedule.
+    """
+    digest = hashlib.sha1()
+    for row_index, part_row in indexed_rows:
+        digest.update(repr((row_index, part_row['gene_symbol'], part_row['disease_code'])))
+    exponents, damping_exponent = dwpc_exponent_list(dwpc_exponent)
+    return {'dwpc_exponents': exponents, 'max_length': max_length,
+            'rows': len(indexed_rows), 'row_digest': digest.hexdigest()}
+
+def dwpc_exponent_list(dwpc_exponent):
+    """
+    Return dwpc_exponent, a damping exponent or a sequence of them, as a
+    list, and the damping_exponent to pass to pathtools: a single exponent
+    is passed as a float, so its DWPCs are computed exactly as before.
+    """
+    if pathtools.exponent_array(dwpc_exponent) is None:
+        return [dwpc_exponent], dwpc_exponent
+    exponents = list(dwpc_exponent)
+    return exponents, (exponents[0] if len(exponents) == 1 else exponents)
+
+def dwpc_features(exponents, metapath, dwpcs):
+    """
+    Yield the (feature name, DWPC) items of metapath, one per exponent, for
+    dwpcs computed with the damping_exponent of dwpc_exponent_list.
+    """
+    if len(exponents) == 1:
+        dwpcs = [dwpcs]
+    for exponent, dwpc in zip(exponents, dwpcs):
+        yield 'DWPC_{}|{}'.format(exponent, metapath), float(dwpc)
+
+def compute_features(graph, part_rows, feature_path, dwpc_exponent,
+                     checkpoint_rows=100, resume=False, schedule=False,
+                     progress_seconds=30.0, max_length=3,
+                     feature_format='tsv'):
+    """
+    Compute the features of part_rows and write them to feature_path. With
+    schedule, rows are processed in the order of schedule_rows and the
+    output gains a leading row_index column giving each row's original
+    position. dwpc_exponent may be a sequence of damping exponents, which
+    are computed together, giving a DWPC column per exponent and metapath.
+    feature_format is a key of feature_writers: 'tsv' for a gzipped TSV or
+    'npz' for a directory of columnar chunks.
+    """
+
+    print('Initial Memory Usage: {:.1f}. Cache Budget: {:.1f}'.format(
+        pathtools.memory_usage() / 1024.0, pathtools.cache.max_bytes / 2.0 ** 30))
 
     # Define Metapaths
     metagraph = graph.metagraph
-    metapaths = metagraph.extract_metapaths('gene', 'disease', max_length=3)
+    metapaths = metagraph.extract_metapaths('gene', 'disease', max_length=max_length)
     metapath_GaD = metapaths.pop(0)
-    metapath_DaG = metapath_GaD.inverse
+    exponents, damping_exponent = dwpc_exponent_list(dwpc_exponent)
 
     # open output_file
-    feature_file = gzip.open(feature_path, 'w')
+    indexed_rows = schedule_rows(part_rows, schedule)
+    settings = run_settings(indexed_rows, dwpc_exponent, max_length)
+    feature_writer = feature_writers[feature_format](feature_path, checkpoint_rows, resume, settings)
 
     total_edges = len(part_rows)
-    writer = None
-    for i, part_row in enumerate(part_rows):
-        time_start = time.clock()
+    start = feature_writer.completed
+    progress = instrumentation.Progress(total_edges, progress_seconds, start)
+    for i, (row_index, part_row) in enumerate(indexed_rows[start:], start):
 
         disease_code = part_row['disease_code']
         gene_symbol = part_row['gene_symbol']
@@ -38,6 +324,8 @@ def compute_features(graph, part_rows, feature_path, dwpc_exponent):
         exclude_edges = {edge, edge.inverse} if edge else set()
 
         features = collections.OrderedDict()
+        if schedule:
+            features['row_index'] = row_index
         features['gene_code'] = part_row['gene_code']
         features['gene_symbol'] = gene_symbol
         features['disease_code'] = disease_code
@@ -47,39 +335,130 @@ def compute_features(graph, part_rows, feature_path, dwpc_exponent):
         features['percentile'] = part_row['percentile']
         features['part'] = part_row['part']
 
-        features['PC_s|G-a-D'] = len(hetnet.pathtools.filtered_crdfs_paths_from(
-            source, metapath_GaD, exclude_edges=exclude_edges))
-        features['PC_t|G-a-D'] = len(hetnet.pathtools.filtered_crdfs_paths_from(
-            target, metapath_DaG, exclude_edges=exclude_edges))
+        metrics_GaD = pathtools.path_metrics(
+            source, target, metapath_GaD, exclude_edges=exclude_edges)
+        features['PC_s|G-a-D'] = metrics_GaD['PC_s']
+        features['PC_t|G-a-D'] = metrics_GaD['PC_t']
 
         for metapath in metapaths:
-            feature_name = 'DWPC_{}|{}'.format(dwpc_exponent, metapath)
-
-            paths = hetnet.pathtools.crdfs_paths_fromto(target, source, metapath.inverse,
-                                                        exclude_edges=exclude_edges)
-            dwpc = hetnet.pathtools.degree_weighted_path_count(paths,
-                damping_exponent=dwpc_exponent, exclude_edges=exclude_edges)
-            features[feature_name] = dwpc
-        if writer is None:
-            print 'Initializing writer'
-            fieldnames = features.keys()
-            writer = csv.DictWriter(feature_file, fieldnames=fieldnames, delimiter='\t')
-            writer.writeheader()
-        writer.writerow(features)
-
-        time_end = time.clock()
-        percent = 100.0 * i / total_edges
-        print 'cache size {} | memory {:.3f} | seconds {:.3f}'.format(
-            len(hetnet.pathtools.cache), hetnet.pathtools.memory_usage() / 1024.0, time_end - time_start)
-        print '{:.1f}% -  {:10}{}'.format(percent, gene_symbol, part_row['disease_name'])
-
-    feature_file.close()
-
-def read_graph(network_dir):
-    path = os.path.join(network_dir, 'graph.pkl.gz')
+            # DWPCs from target to all genes are reused and corrected for exclusions
+            dwpcs = pathtools.corrected_dwpc_between(target, source, metapath.inverse,
+                damping_exponent=damping_exponent, exclude_edges=exclude_edges)
+            features.update(dwpc_features(exponents, metapath, dwpcs))
+        feature_writer.writerow(features)
+
+        progress.update(i + 1, 'cache size {} | cache GB {:.3f} | hit rate {:.3f} | {} {}'.format(
+            len(pathtools.cache), pathtools.cache.bytes / 2.0 ** 30,
+            pathtools.cache_hit_rate(), gene_symbol, part_row['disease_name']))
+
+    feature_writer.close()
+    print 'cache statistics {}'.format(pathtools.cache.stats())
+    disk_cache = pathtools.disk_cache
+    if disk_cache is not None:
+        print 'disk cache hits {} | misses {} | writes {}'.format(
+            disk_cache.hits, disk_cache.misses, disk_cache.writes)
+
+# state of each worker process, set by _initialize_worker
+worker_state = dict()
+
+def _initialize_worker(compiled_dir, metapath_GaD_id, metapath_ids, dwpc_exponent):
+    compiled_graph = compiled.CompiledGraph.load(compiled_dir)
+    metagraph = compiled_graph.metagraph
+    def get_metapath(metaedge_ids):
+        return metagraph.get_metapath(tuple(metagraph.get_edge(metaedge_id)
+                                            for metaedge_id in metaedge_ids))
+    worker_state['compiled'] = compiled_graph
+    worker_state['metapath_GaD'] = get_metapath(metapath_GaD_id)
+    worker_state['metapaths'] = [get_metapath(metaedge_ids) for metaedge_ids in metapath_ids]
+    worker_state['dwpc_exponents'] = dwpc_exponent_list(dwpc_exponent)
+
+def _compute_row_features(part_row):
+    """Compute the features of part_row in a worker, on the compiled graph."""
+    compiled_graph = worker_state['compiled']
+    metapath_GaD = worker_state['metapath_GaD']
+    metapath_DaG = metapath_GaD.inverse
+    source = compiled_graph.get_index(part_row['gene_symbol'], metapath_GaD.source().id_)
+    target = compiled_graph.get_index(part_row['disease_code'], metapath_GaD.target().id_)
+
+    GaD_id, DaG_id = metapath_GaD[0].get_id(), metapath_DaG[0].get_id()
+    exclude_pairs = set()
+    if compiled_graph.has_edge(GaD_id, source, target):
+        exclude_pairs = {(GaD_id, source, target), (DaG_id, target, source)}
+
+    features = collections.OrderedDict()
+    for key in ['gene_code', 'gene_symbol', 'disease_code', 'disease_name',
+                'status', 'status_int', 'percentile', 'part']:
+        features[key] = part_row[key]
+    features['PC_s|G-a-D'] = compiled_graph.aggregate_paths(
+        source, None, metapath_GaD, exclude_pairs=exclude_pairs)[0]
+    features['PC_t|G-a-D'] = compiled_graph.aggregate_paths(
+        target, None, metapath_DaG, exclude_pairs=exclude_pairs)[0]
+    exponents, damping_exponent = worker_state['dwpc_exponents']
+    for metapath in worker_state['metapaths']:
+        dwpcs = compiled_graph.aggregate_paths(
+            target, source, metapath.inverse, damping_exponent, exclude_pairs)[1]
+        features.update(dwpc_features(exponents, metapath, dwpcs))
+    return features
+
+def compute_features_parallel(graph, part_rows, feature_path, dwpc_exponent, workers,
+                              checkpoint_rows=100, resume=False, schedule=False,
+                              progress_seconds=30.0, max_length=3,
+                              feature_format='tsv'):
+    """
+    Compute the same features as compute_features using a pool of workers.
+    The graph is compiled and saved to a temporary directory which every
+    worker memory-maps, so the adjacency is shared rather than copied into
+    each process. Rows are written in the order of schedule_rows. The
+    compiled degrees ignore masks, so a graph with masks raises ValueError
+    rather than giving features which differ from compute_features.
+    """
+    if graph.has_masked():
+        raise ValueError('compute_features_parallel requires a graph without masks')
+    metagraph = graph.metagraph
+    metapaths = metagraph.extract_metapaths('gene', 'disease', max_length=max_length)
+    metapath_GaD = metapaths.pop(0)
+    metapath_ids = [[metaedge.get_id() for metaedge in metapath] for metapath in metapaths]
+
+    # the writer validates a resumed run before any workers are started
+    indexed_rows = schedule_rows(part_rows, schedule)
+    settings = run_settings(indexed_rows, dwpc_exponent, max_length)
+    feature_writer = feature_writers[feature_format](feature_path, checkpoint_rows, resume, settings)
+    indexed_rows = indexed_rows[feature_writer.completed:]
+    total_edges = len(part_rows)
+    start = feature_writer.completed
+    chunksize = max(1, (total_edges - start) // (workers * 16))
+    progress = instrumentation.Progress(total_edges, progress_seconds, start)
+
+    compiled_dir = tempfile.mkdtemp(prefix='compiled-')
+    pool = None
+    try:
+        graph.compile().save(compiled_dir)
+        initargs = (compiled_dir, [metapath_GaD[0].get_id()], metapath_ids, dwpc_exponent)
+        pool = multiprocessing.Pool(workers, _initialize_worker, initargs)
+        rows = pool.imap(_compute_row_features, [part_row for row_index, part_row in indexed_rows], chunksize)
+        for i, ((row_index, part_row), features) in enumerate(itertools.izip(indexed_rows, rows), start):
+            if schedule:
+                features = collections.OrderedDict([('row_index', row_index)] + features.items())
+            feature_writer.writerow(features)
+            progress.update(i + 1)
+        pool.close()
+        feature_writer.close()
+    except:
+        if pool is not None:
+            pool.terminate()
+        raise
+    finally:
+        if pool is not None:
+            pool.join()
+        shutil.rmtree(compiled_dir)
+
+def read_graph(network_dir, path=None):
+    if path is None:
+        path = os.path.join(network_dir, 'graph.pkl.gz')
     # Load graph
     print 'loading graph'
-    graph = readwrite.read_pickle(path)
+    with pathtools.instruments.timer('read_graph'):
+        graph = readwrite.read_pickle(path)
     print 'graph loaded'
     return graph
 
@@ -98,12 +477,39 @@ if __name__ == '__main__':
     parser.add_argument('--network-dir', type=os.path.expanduser, default=
         'networks/')
     parser.add_argument('--partition-path', type=os.path.expanduser)
+    parser.add_argument('--graph-path', type=os.path.expanduser,
+        help='graph to load instead of network-dir/graph.pkl.gz, such as a shard')
     parser.add_argument('--feature-path', type=os.path.expanduser)
-    parser.add_argument('--dwpc-exponent', default=0.4, type=float)
-    parser.add_argument('--max-gb', default=60.0, type=float)
+    parser.add_argument('--feature-format', default='tsv', choices=sorted(feature_writers),
+        help='tsv writes a gzipped TSV, npz a directory of float64 chunks of checkpoint-rows rows')
+    parser.add_argument('--dwpc-exponent', default=[0.4], type=float, nargs='+',
+        help='damping exponents, each giving a DWPC column per metapath')
+    parser.add_argument('--max-length', default=3, type=int,
+        help='maximum length of the gene-disease metapaths')
+    parser.add_argument('--max-gb', default=60.0, type=float,
+        help='budget of the path cache in estimated gigabytes')
+    parser.add_argument('--cache-policy', default='lru', choices=pathcache.PathCache.policies,
+        help='eviction policy of the path cache')
+    parser.add_argument('--workers', default=1, type=int,
+        help='number of processes, sharing the graph in memory-mapped arrays')
+    parser.add_argument('--checkpoint-rows', default=100, type=int,
+        help='rows between checkpoints of the feature file')
+    parser.add_argument('--resume', action='store_true',
+        help='continue after the last checkpoint of an interrupted run')
+    parser.add_argument('--schedule', action='store_true',
+        help='process rows grouped by disease and gene for cache reuse, '
+             'adding a row_index column of the original order')
+    parser.add_argument('--progress-seconds', default=30.0, type=float,
+        help='minimum seconds between progress reports')
+    parser.add_argument('--disk-cache-dir', type=os.path.expanduser,
+        help='directory of a persistent path cache shared across runs')
+    parser.add_argument('--instrument-path', type=os.path.expanduser,
+        help='record per-metapath timings and counters, writing them here as JSON')
     args = parser.parse_args()
 
-    hetnet.pathtools.max_MB = args.max_gb * 1024.0
+    pathtools.cache = pathcache.PathCache(
+        max_bytes=int(args.max_gb * 2 ** 30), policy=args.cache_policy)
+    pathtools.instruments.enabled = args.instrument_path is not None
 
     # filesystem
     network_dir = args.network_dir
@@ -112,8 +518,22 @@ if __name__ == '__main__':
         os.mkdir(path_head)
 
     # Read Objects
-    graph = read_graph(network_dir)
+    graph = read_graph(network_dir, args.graph_path)
     part_rows = read_part(args.partition_path)
+    if args.disk_cache_dir is not None:
+        pathtools.use_disk_cache(args.disk_cache_dir, graph)
 
     # Compute features
-    compute_features(graph, part_rows, args.feature_path, args.dwpc_exponent)
+    if args.workers > 1:
+        compute_features_parallel(graph, part_rows, args.feature_path,
+                                  args.dwpc_exponent, args.workers,
+                                  args.checkpoint_rows, args.resume, args.schedule,
+                                  args.progress_seconds, args.max_length, args.feature_format)
+    else:
+        compute_features(graph, part_rows, args.feature_path, args.dwpc_exponent,
+                         args.checkpoint_rows, args.resume, args.schedule,
+                         args.progress_seconds, args.max_length, args.feature_format)
+
+    if args.instrument_path is not None:
+        pathtools.instruments.report()
+        pathtools.instruments.dump(args.instrument_path)
@@ -0,0 +1,85 @@
+import hashlib
+import os
+import tempfile
+
+import numpy
+
+
+def graph_fingerprint(graph):
+    """
+    Return a hex digest identifying graph: its nodes and edges in int_id
+    order and its degree offsets. Cached results refer to nodes and edges
+    by int_id, so they are only valid for a graph with the same fingerprint.
+    Masks are not included, as they change during a run, so results which
+    depend on masks must not be stored while the graph has any.
+    """
+    digest = hashlib.sha1()
+    for node in graph.node_list:
+        digest.update(repr((node.id_, node.metanode.id_)))
+    for edge in graph.edge_list:
+        digest.update(repr(edge.get_id()))
+    offsets = sorted((node.int_id, metaedge.get_id(), offset)
+                     for (node, metaedge), offset in graph.degree_index.offsets.iteritems())
+    digest.update(repr(offsets))
+    return digest.hexdigest()
+
+
+class DiskCache(object):
+    """
+    Persistent cache of numpy arrays in directory, namespaced by a graph
+    fingerprint so that runs over the same graph share entries. Each entry
+    is a .npy file named by a hash of its key. Writes go to a temporary file
+    which is renamed into place, so concurrent processes never read a
+    partial entry, and reads are memory-mapped.
+    """
+
+    def __init__(self, directory, fingerprint):
+        self.directory = os.path.join(directory, fingerprint)
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError:
+                # another process created it
+                if not os.path.isdir(self.directory):
+                    raise
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+
+    def path(self, key):
+        name = hashlib.sha1(repr(key)).hexdigest()
+        return os.path.join(self.directory, name[:2], name + '.npy')
+
+    def get(self, key):
+        """Return the array stored under key, or None if absent."""
+        path = self.path(key)
+        if not os.path.exists(path):
+            self.misses += 1
+            return None
+        try:
+            array = numpy.load(path, mmap_mode='r')
+        except ValueError:
+            # empty arrays cannot be memory-mapped
+            array = numpy.load(path)
+        self.hits += 1
+        return array
+
+    def set(self, key, array):
+        """Atomically store array under key."""
+        path = self.path(key)
+        subdirectory = os.path.dirname(path)
+        if not os.path.isdir(subdirectory):
+            try:
+                os.mkdir(subdirectory)
+            except OSError:
+                if not os.path.isdir(subdirectory):
+                    raise
+        descriptor, temp_path = tempfile.mkstemp(suffix='.tmp', dir=subdirectory)
+        try:
+            with os.fdopen(descriptor, 'wb') as write_file:
+                numpy.save(write_file, array)
+            os.rename(temp_path, path)
+        except:
+            os.remove(temp_path)
+            raise
+        self.writes += 1
@@ -0,0 +1,404 @@
+import argparse
+import collections
+import csv
+import gzip
+import os
+import random
+import shutil
+import sys
+import tempfile
+
+import hetnet
+import hetnet.computefeatures
+import hetnet.matrix
+import hetnet.pathcache
+import hetnet.pathtools
+import hetnet.planner
+import hetnet.sharding
+
+
+def random_graph(n_genes, n_diseases, n_tissues, n_edges, seed=0):
+    """
+    Build a random graph of genes, diseases and tissues with n_edges edges
+    of each metaedge, as a fixture for comparing path implementations.
+    """
+    metaedges = [('gene', 'disease', 'association', 'both'),
+                 ('gene', 'gene', 'interaction', 'both'),
+                 ('gene', 'tissue', 'expression', 'both'),
+                 ('disease', 'tissue', 'localization', 'both')]
+    metagraph = hetnet.MetaGraph.from_edge_tuples(metaedges)
+    rng = random.Random(seed)
+    ids = {'gene': ['G{}'.format(i) for i in xrange(n_genes)],
+           'disease': ['D{}'.format(i) for i in xrange(n_diseases)],
+           'tissue': ['T{}'.format(i) for i in xrange(n_tissues)]}
+    graph = hetnet.Graph(metagraph)
+    for kind in sorted(ids):
+        for id_ in ids[kind]:
+            graph.add_node(id_, kind)
+    for source_kind, target_kind, kind, direction in metaedges:
+        n_possible = len(ids[source_kind]) * len(ids[target_kind])
+        edge_tuples = set()
+        while len(edge_tuples) < min(n_edges, n_possible / 2):
+            source = rng.choice(ids[source_kind])
+            target = rng.choice(ids[target_kind])
+            if source_kind == target_kind and source >= target:
+                continue
+            edge_tuples.add((source, target))
+        for source, target in sorted(edge_tuples):
+            graph.add_edge(source, target, kind, direction)
+    return graph
+
+def maskable_edges(graph, n_edges, seed=0):
+    """
+    Return up to n_edges random edges, each with its inverse, whose masking
+    leaves every node with two edges of each metaedge it had two of, so
+    DWPCs remain defined when another edge of a node is excluded.
+    """
+    rng = random.Random(seed)
+    edges = [edge for edge in graph.edge_list if not edge.inverted]
+    rng.shuffle(edges)
+    degrees = dict()
+    chosen = list()
+    for edge in edges:
+        if len(chosen) == 2 * n_edges:
+            break
+        ends = (edge.source, edge.metaedge), (edge.target, edge.metaedge.inverse)
+        for node, metaedge in ends:
+            degrees.setdefault((node, metaedge), len(node.edges[metaedge]))
+        if any(degrees[end] < 3 for end in ends):
+            continue
+        for end in ends:
+            degrees[end] -= 1
+        chosen.extend((edge, edge.inverse))
+    return chosen
+
+def isclose(a, b):
+    return abs(a - b) <= 1e-9 * max(1.0, abs(a), abs(b))
+
+def allclose(values, expected):
+    return len(values) == len(expected) and all(isclose(a, b) for a, b in zip(values, expected))
+
+def path_set(paths):
+    """Return paths, as Paths or tuples of Edges, as a set of int_id tuples."""
+    return {tuple(edge.int_id for edge in path) for path in paths or ()}
+
+def reference_dwpc(paths, damping_exponent, exclude_masked=True):
+    """The DWPC of paths summed path by path, as computed before batching."""
+    pathtools = hetnet.pathtools
+    return sum(1.0 / pathtools.path_degree_product(path, damping_exponent, exclude_masked=exclude_masked)
+               for path in paths)
+
+def check_paths(graph, compiled_graph, metapaths, sources, n_targets=3):
+    """
+    Compare each path retrieval function with Graph.paths_from, for the
+    paths from every source following every metapath, and the query planner
+    and Graph.paths_between for up to n_targets targets of each. While the
+    graph has masks, paths through masked elements are excluded from both.
+    compiled_graph must be compiled from graph. Returns a Counter of the
+    mismatches of each function.
+    """
+    pathtools = hetnet.pathtools
+    planner = hetnet.planner.QueryPlanner(graph)
+    mismatches = collections.Counter()
+    masked = graph.has_masked()
+    for metapath in metapaths:
+        for source in sources:
+            expected = path_set(graph.paths_from(source, metapath, masked=not masked))
+            if masked:
+                candidates = {
+                    'filtered_crdfs_paths_from': pathtools.filtered_crdfs_paths_from(
+                        source, metapath, exclude_masked=True),
+                    'iter_paths_from': graph.iter_paths_from(source, metapath, masked=False),
+                    'CompiledGraph.paths_from': compiled_graph.paths_from(source, metapath, masked=False),
+                }
+            else:
+                candidates = {
+                    'crdfs_paths_from': pathtools.crdfs_paths_from(source, metapath),
+                    'iter_crdfs_paths': pathtools.iter_crdfs_paths(source, metapath),
+                    'iter_paths_from': graph.iter_paths_from(source, metapath),
+                    'CompiledGraph.crdfs_paths_from': compiled_graph.crdfs_paths_from(source, metapath),
+                }
+                mismatches['count_paths_from'] += (
+                    pathtools.count_paths_from(source, metapath) != len(expected))
+            for name, paths in candidates.iteritems():
+                mismatches[name] += path_set(paths) != expected
+
+            edge_list = graph.edge_list
+            targets = sorted({edge_list[path[-1]].target for path in expected})[:n_targets]
+            for target in targets:
+                between = {path for path in expected if edge_list[path[-1]].target is target}
+                paths = graph.paths_between(source, target, metapath, masked=not masked)
+                mismatches['paths_between'] += path_set(paths) != between
+                paths = planner.paths_between(source, target, metapath, masked=not masked)
+                mismatches['QueryPlanner.paths_between'] += path_set(paths) != between
+    return mismatches
+
+def check_dwpcs(graph, compiled_graph, metapaths, sources, damping_exponents=(0.4, 0.7)):
+    """
+    Compare each DWPC function with DWPCs summed path by path over
+    crdfs_paths_fromto, for every source and reachable target of every
+    metapath, for the first damping exponent and for all of them at once.
+    Degrees exclude masked edges. path_metrics, which also excludes paths
+    through masked elements, is compared with the sum over unmasked paths.
+    The compiled graph ignores masks, so it is only compared without them.
+    Returns a Counter of the mismatches of each function.
+    """
+    pathtools = hetnet.pathtools
+    exponent = damping_exponents[0]
+    exponents = list(damping_exponents)
+    mismatches = collections.Counter()
+    masked = graph.has_masked()
+    for metapath in metapaths:
+        target_kind = metapath[-1].target.id_
+        for source in sources:
+            dwpcs = pathtools.dwpcs_from(source, metapath, exponent)
+            multi_dwpcs = pathtools.dwpcs_from(source, metapath, exponents)
+            targets = {path[-1].target for path in pathtools.crdfs_paths_from(source, metapath)}
+            mismatches['dwpcs_from targets'] += set(dwpcs) != targets
+            for target in sorted(targets):
+                paths = pathtools.crdfs_paths_fromto(source, target, metapath)
+                expected = [reference_dwpc(paths, e) for e in exponents]
+                unmasked = [path for path in paths if not path.is_masked()]
+                expected_unmasked = [reference_dwpc(unmasked, e) for e in exponents]
+
+                candidates = {
+                    'degree_weighted_path_count': (
+                        pathtools.degree_weighted_path_count(paths, exponent),
+                        pathtools.degree_weighted_path_count(paths, exponents)),
+                    'dwpc_between': (
+                        pathtools.dwpc_between(source, target, metapath, exponent),
+                        pathtools.dwpc_between(source, target, metapath, exponents)),
+                    'dwpcs_from': (dwpcs[target][1], multi_dwpcs[target][1]),
+                    'corrected_dwpc_between': (
+                        pathtools.corrected_dwpc_between(source, target, metapath, exponent),
+                        pathtools.corrected_dwpc_between(source, target, metapath, exponents)),
+                }
+                if not masked:
+                    source_index = compiled_graph.get_index(source, metapath[0].source.id_)
+                    target_index = compiled_graph.get_index(target, target_kind)
+                    candidates['CompiledGraph.aggregate_paths'] = (
+                        compiled_graph.aggregate_paths(source_index, target_index, metapath, exponent)[1],
+                        compiled_graph.aggregate_paths(source_index, target_index, metapath, exponents)[1])
+                    if len(metapath) <= 3:
+                        candidates['matrix.dwpc'] = (
+                            hetnet.matrix.dwpc(compiled_graph, source, target, metapath, exponent),
+                            [hetnet.matrix.dwpc(compiled_graph, source, target, metapath, e)
+                             for e in exponents])
+                for name, (single, multi) in candidates.iteritems():
+                    mismatches[name] += not (isclose(single, expected[0]) and allclose(multi, expected))
+
+                metrics = pathtools.path_metrics(source, target, metapath, exponent, exclude_masked=True)
+                multi_metrics = pathtools.path_metrics(source, target, metapath, exponents,
+                                                       exclude_masked=True)
+                mismatches['path_metrics'] += not (
+                    metrics['PC'] == len(unmasked) and
+                    isclose(metrics['DWPC'], expected_unmasked[0]) and
+                    allclose(multi_metrics['DWPC'], expected_unmasked))
+                mismatches['dwpcs_from counts'] += dwpcs[target][0] != len(paths)
+    return mismatches
+
+def check_corrected_dwpc(graph, metapaths, damping_exponent=0.4, mask_edges=()):
+    """
+    Compare corrected_dwpc_between to dwpc_between for every gene and
+    disease, excluding any edges between them. The comparison is repeated
+    after masking mask_edges, which changes the degrees behind the cached
+    dwpcs_from results, and after unmasking them. Returns the number of
+    mismatches.
+    """
+    pathtools = hetnet.pathtools
+    genes = [node for node in graph.node_list if node.metanode.id_ == 'gene']
+    diseases = [node for node in graph.node_list if node.metanode.id_ == 'disease']
+    def compare():
+        mismatches = 0
+        for metapath in metapaths:
+            for source in genes:
+                for target in diseases:
+                    exclude_edges = {edge for metaedge in source.edges
+                                     for edge in source.edges[metaedge] if edge.target is target}
+                    exclude_edges.update([edge.inverse for edge in exclude_edges])
+                    corrected = pathtools.corrected_dwpc_between(
+                        source, target, metapath, damping_exponent, exclude_edges)
+                    expected = pathtools.dwpc_between(
+                        source, target, metapath, damping_exponent, exclude_edges=exclude_edges)
+                    mismatches += not isclose(corrected, expected)
+        return mismatches
+    mismatches = compare()
+    with graph.masking(edges=mask_edges):
+        mismatches += compare()
+    mismatches += compare()
+    return mismatches
+
+def same_dwpcs(dwpcs, expected):
+    """Return whether two dwpcs_from results agree."""
+    return set(dwpcs) == set(expected) and all(
+        dwpcs[key][0] == expected[key][0] and isclose(dwpcs[key][1], expected[key][1])
+        for key in expected)
+
+def check_caches(graph, metapaths, sources):
+    """
+    Compare crdfs_paths_from and dwpcs_from results computed through a
+    PathCache with a tenth of the budget they need, which evicts entries
+    while they are in use, and read back from a DiskCache, with results
+    computed through an unbounded cache. Returns a Counter of mismatches.
+    """
+    pathtools = hetnet.pathtools
+    saved = pathtools.cache, pathtools.disk_cache
+    directory = tempfile.mkdtemp(prefix='diskcache-')
+    mismatches = collections.Counter()
+    try:
+        pathtools.cache = hetnet.pathcache.PathCache()
+        pathtools.disk_cache = None
+        queries = [(source, metapath) for metapath in metapaths for source in sources]
+        expected = {query: (path_set(pathtools.crdfs_paths_from(*query)),
+                            pathtools.dwpcs_from(query[0], query[1], 0.4))
+                    for query in queries}
+        max_bytes = max(pathtools.cache.bytes / 10, 1)
+        pathtools.use_disk_cache(directory, graph)
+        for label in 'budget', 'disk':
+            for policy in hetnet.pathcache.PathCache.policies:
+                pathtools.cache = hetnet.pathcache.PathCache(max_bytes, policy)
+                for query in queries:
+                    paths, dwpcs = expected[query]
+                    mismatches[label + ' paths'] += path_set(pathtools.crdfs_paths_from(*query)) != paths
+                    mismatches[label + ' dwpcs'] += not same_dwpcs(
+                        pathtools.dwpcs_from(query[0], query[1], 0.4), dwpcs)
+                mismatches[label + ' budget exceeded'] += pathtools.cache.bytes > max_bytes
+        mismatches['disk hits'] += not pathtools.disk_cache.hits
+    finally:
+        pathtools.cache, pathtools.disk_cache = saved
+        shutil.rmtree(directory)
+    return mismatches
+
+def check_shards(graph, metapaths, sources, n_shards=3):
+    """
+    Compare the DWPCs of each source computed on its shard from
+    sharding.make_shards with those computed on graph. Returns a Counter.
+    """
+    pathtools = hetnet.pathtools
+    mismatches = collections.Counter()
+    groups = hetnet.sharding.partition_sources(sources, n_shards)
+    shards = hetnet.sharding.make_shards(graph, sources, metapaths, n_shards)
+    for group, shard in zip(groups, shards):
+        for source in group:
+            for metapath in metapaths:
+                expected = pathtools.dwpcs_from(source, metapath, 0.4)
+                dwpcs = pathtools.dwpcs_from(shard.node_dict[source.id_], metapath, 0.4)
+                expected = {target.id_: value for target, value in expected.iteritems()}
+                dwpcs = {target.id_: value for target, value in dwpcs.iteritems()}
+                mismatches['shard dwpcs'] += not same_dwpcs(dwpcs, expected)
+    return mismatches
+
+def read_tsv_features(feature_path):
+    """Read a gzipped TSV of features into a dict of (gene, disease) to row."""
+    with gzip.open(feature_path) as read_file:
+        rows = list(csv.DictReader(read_file, delimiter='\t'))
+    return {(row['gene_symbol'], row['disease_code']): row for row in rows}
+
+def check_features(graph, n_diseases=3, checkpoint_rows=7):
+    """
+    Compare the features written by compute_features with the defaults to
+    those written with the row schedule, several exponents, columnar output,
+    by workers and by a run resumed after failing midway. Returns a Counter
+    of the rows whose features differ for each variant.
+    """
+    computefeatures = hetnet.computefeatures
+    genes = sorted(node.id_ for node in graph.node_list if node.metanode.id_ == 'gene')
+    diseases = sorted(node.id_ for node in graph.node_list if node.metanode.id_ == 'disease')
+    part_rows = [{'gene_code': gene, 'gene_symbol': gene, 'disease_code': disease,
+                  'disease_name': disease, 'status': '', 'status_int': 0,
+                  'percentile': '', 'part': '0'}
+                 for gene in genes for disease in diseases[:n_diseases]]
+    directory = tempfile.mkdtemp(prefix='features-')
+    def path(name):
+        return os.path.join(directory, name)
+    def compare(label, rows, fields):
+        for key, row in expected.iteritems():
+            mismatches[label] += not all(isclose(float(rows[key][field]), float(row[field]))
+                                         for field in fields)
+
+    class FailingWriter(computefeatures.FeatureWriter):
+        def writerow(self, features):
+            if self.completed + self.pending == len(part_rows) / 2:
+                # rows after the last checkpoint reach the file, as in a crash
+                if self.feature_file is not None:
+                    self.feature_file.close()
+                raise RuntimeError('simulated failure')
+            computefeatures.FeatureWriter.writerow(self, features)
+
+    mismatches = collections.Counter()
+    try:
+        kwargs = {'checkpoint_rows': checkpoint_rows, 'progress_seconds': float('inf')}
+        computefeatures.compute_features(graph, part_rows, path('expected.tsv.gz'), 0.4, **kwargs)
+        expected = read_tsv_features(path('expected.tsv.gz'))
+        fields = [field for field in expected.values()[0] if '|' in field]
+
+        computefeatures.compute_features(graph, part_rows, path('schedule.tsv.gz'), 0.4,
+                                         schedule=True, **kwargs)
+        compare('schedule', read_tsv_features(path('schedule.tsv.gz')), fields)
+
+        computefeatures.compute_features(graph, part_rows, path('exponents.tsv.gz'), [0.4, 0.7], **kwargs)
+        compare('exponents', read_tsv_features(path('exponents.tsv.gz')), fields)
+
+        computefeatures.compute_features(graph, part_rows, path('columnar'), 0.4,
+                                         feature_format='npz', **kwargs)
+        names, features, metadata = computefeatures.read_columnar_features(path('columnar'))
+        rows = {(gene, disease): dict(zip(names, values)) for gene, disease, values in
+                zip(metadata['gene_symbol'], metadata['disease_code'], features)}
+        compare('npz', rows, fields)
+
+        computefeatures.compute_features_parallel(graph, part_rows, path('parallel.tsv.gz'), 0.4, 2,
+                                                  **kwargs)
+        compare('parallel', read_tsv_features(path('parallel.tsv.gz')), fields)
+
+        writer = computefeatures.feature_writers['tsv']
+        computefeatures.feature_writers['tsv'] = FailingWriter
+        try:
+            computefeatures.compute_features(graph, part_rows, path('resume.tsv.gz'), 0.4, **kwargs)
+        except RuntimeError:
+            pass
+        finally:
+            computefeatures.feature_writers['tsv'] = writer
+        computefeatures.compute_features(graph, part_rows, path('resume.tsv.gz'), 0.4,
+                                         resume=True, **kwargs)
+        rows = read_tsv_features(path('resume.tsv.gz'))
+        mismatches['resume rows'] += len(rows) != len(expected)
+        compare('resume', rows, fields)
+    finally:
+        shutil.rmtree(directory)
+    return mismatches
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--genes', default=60, type=int)
+    parser.add_argument('--edges', default=120, type=int)
+    parser.add_argument('--seed', default=0, type=int)
+    args = parser.parse_args()
+
+    graph = random_graph(args.genes, max(args.genes / 8, 2), max(args.genes / 10, 2),
+                         args.edges, args.seed)
+    metapaths = graph.metagraph.extract_metapaths('gene', 'disease', 3)
+    genes = sorted(node for node in graph.node_list if node.metanode.id_ == 'gene')
+    mask_edges = maskable_edges(graph, max(args.edges / 10, 1), args.seed)
+    compiled_graph = graph.compile()
+    hetnet.pathtools.disk_cache = None
+
+    results = list()
+    results.append(('paths', check_paths(graph, compiled_graph, metapaths, genes)))
+    results.append(('dwpcs', check_dwpcs(graph, compiled_graph, metapaths, genes)))
+    with graph.masking(edges=mask_edges):
+        results.append(('masked paths', check_paths(graph, compiled_graph, metapaths, genes)))
+        results.append(('masked dwpcs', check_dwpcs(graph, compiled_graph, metapaths, genes)))
+    mismatches = check_corrected_dwpc(graph, [metapath for metapath in metapaths if len(metapath) > 1],
+                                      mask_edges=mask_edges)
+    results.append(('corrected dwpcs', {'corrected_dwpc_between': mismatches}))
+    results.append(('caches', check_caches(graph, metapaths, genes)))
+    results.append(('shards', check_shards(graph, metapaths, genes)))
+    results.append(('features', check_features(graph)))
+
+    failures = 0
+    for label, mismatches in results:
+        for name in sorted(mismatches):
+            print('{} | {} mismatches {}'.format(label, name, mismatches[name]))
+            failures += mismatches[name]
+    sys.exit(1 if failures else 0)
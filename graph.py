@@ -1,7 +1,12 @@
 # daniel.himmelstein@gmail.com
 import itertools
 import collections
+import gc
 
+import numpy
+
+import compiled
+import masking
 import readwrite
 
 direction_to_inverse = {'forward': 'backward',
@@ -10,8 +15,14 @@ direction_to_inverse = {'forward': 'backward',
 
 direction_to_abbrev = {'forward': '>', 'backward': '<', 'both': '-'}
 
+# Shared by node edge sets with no edges to save memory. Nodes receive
+# their own set when an edge is added.
+empty_edges = frozenset()
+
 class ElemMask(object):
-    
+
+    __slots__ = ()
+
     def __init__(self):
         self.masked = False
 
@@ -25,7 +36,9 @@ class ElemMask(object):
         self.masked = False
 
 class IterMask(object):
-    
+
+    __slots__ = ()
+
     def is_masked(self):
         return any(elem.is_masked() for elem in self.mask_elem_iter())
 
@@ -52,9 +65,10 @@ class BaseGraph(object):
             yield edge
 
 class BaseNode(ElemMask):
-    
+
+    __slots__ = ('id_', )
+
     def __init__(self, id_):
-        ElemMask.__init__(self)
         self.id_ = id_
     
     def __hash__(self):
@@ -70,9 +84,10 @@ class BaseNode(ElemMask):
         return self.id_    
 
 class BaseEdge(ElemMask):
-    
+
+    __slots__ = ('source', 'target')
+
     def __init__(self, source, target):
-        ElemMask.__init__(self)
         self.source = source
         self.target = target
     
@@ -88,7 +103,9 @@ class BaseEdge(ElemMask):
         return '{0} {3} {2} {3} {1}'.format(source, target, kind, dir_abbrev)
 
 class BasePath(IterMask):
-    
+
+    __slots__ = ('edges', )
+
     def __init__(self, edges):
         assert isinstance(edges, tuple)
         self.edges = edges
@@ -142,6 +159,7 @@ class MetaGraph(BaseGraph):
     def __init__(self):
         """ """
         BaseGraph.__init__(self)
+        self.metapath_cache = dict()
     
     @staticmethod
     def from_edge_tuples(metaedge_tuples):
@@ -220,6 +238,7 @@ class MetaGraph(BaseGraph):
     def add_edge(self, edge_id):
         """source_kind, target_kind, kind, direction"""
         assert edge_id not in self.edge_dict
+        self.metapath_cache.clear()
         source_kind, target_kind, kind, direction = edge_id
         source = self.get_node(source_kind)
         target = self.get_node(target_kind)
@@ -243,22 +262,119 @@ class MetaGraph(BaseGraph):
             inverse.inverse = metaedge
             inverse.inverted = True
        
-    def extract_metapaths(self, source_kind, target_kind, max_length):
+    def distances_to(self, target):
+        """
+        Return a dict of metanode to the fewest metaedges needed to reach the
+        metanode target. Every metaedge has an inverse, so this is a breadth
+        first search from target.
+        """
+        distances = {target: 0}
+        frontier = [target]
+        while frontier:
+            next_frontier = list()
+            for metanode in frontier:
+                for metaedge in metanode.edges:
+                    if metaedge.target not in distances:
+                        distances[metaedge.target] = distances[metanode] + 1
+                        next_frontier.append(metaedge.target)
+            frontier = next_frontier
+        return distances
+
+    @staticmethod
+    def canonical_metaedge(metaedge):
+        """Return metaedge or its inverse, whichever is not inverted."""
+        return metaedge.inverse if metaedge.inverted else metaedge
+
+    def extract_metapaths(self, source_kind, target_kind, max_length,
+                          exclude_repeated_metaedges=False, bidirectional=False):
+        """
+        Return a list of the metapaths from source_kind to target_kind with
+        at most max_length metaedges, ordered by length. Partial metapaths
+        which cannot reach target_kind in the remaining metaedges are pruned,
+        and only returned metapaths are registered in path_dict. Setting
+        exclude_repeated_metaedges excludes metapaths which traverse a
+        metaedge (in either direction) more than once. Setting bidirectional
+        grows metapaths from both ends and joins them at their middle, which
+        can change the order of metapaths of the same length. Results are
+        cached per set of arguments.
+        """
+        key = source_kind, target_kind, max_length, exclude_repeated_metaedges, bidirectional
+        try:
+            return list(self.metapath_cache[key])
+        except KeyError:
+            pass
+
         source = self.node_dict[source_kind]
         target = self.node_dict[target_kind]
-        
-        metapaths = [self.get_metapath((edge, )) for edge in source.edges]
-        previous_metapaths = list(metapaths)
-        for depth in range(1, max_length):
-            current_metapaths = list()
-            for metapath in previous_metapaths:
-                for add_edge in metapath.target().edges:
-                    new_metapath = self.get_metapath(metapath.edges + (add_edge, ))
-                    current_metapaths.append(new_metapath)
-            metapaths.extend(current_metapaths)
-            previous_metapaths = current_metapaths
-        metapaths = [metapath for metapath in metapaths if metapath.target() == target]
-        return metapaths
+        if bidirectional:
+            edge_tuples = self._extract_bidirectional(source, target, max_length)
+        else:
+            edge_tuples = self._extract_forward(source, target, max_length)
+        if exclude_repeated_metaedges:
+            canonical = MetaGraph.canonical_metaedge
+            edge_tuples = [edges for edges in edge_tuples
+                           if len(set(map(canonical, edges))) == len(edges)]
+        metapaths = [self.get_metapath(edges) for edges in edge_tuples]
+        self.metapath_cache[key] = metapaths
+        return list(metapaths)
+
+    def _extract_forward(self, source, target, max_length):
+        """Grow metapaths from source, pruning by distance to target."""
+        distances = self.distances_to(target)
+        edge_tuples = list()
+        previous = [tuple()]
+        for depth in range(max_length):
+            remaining = max_length - depth - 1
+            current = list()
+            for edges in previous:
+                metanode = edges[-1].target if edges else source
+                for add_edge in metanode.edges:
+                    if distances.get(add_edge.target, max_length + 1) > remaining:
+                        continue
+                    current.append(edges + (add_edge, ))
+            edge_tuples.extend(edges for edges in current if edges[-1].target == target)
+            previous = current
+        return edge_tuples
+
+    def _extract_bidirectional(self, source, target, max_length):
+        """
+        Grow metapath heads from source and tails from target, each pruned by
+        distance to the other end, and join heads and tails which meet.
+        """
+        head_levels = self._grow_levels(source, target, (max_length + 1) / 2, max_length)
+        tail_levels = self._grow_levels(target, source, max_length / 2, max_length)
+        edge_tuples = list()
+        for length in range(1, max_length + 1):
+            head_length = (length + 1) / 2
+            tail_length = length - head_length
+            tails_by_node = dict()
+            for tail in tail_levels[tail_length]:
+                metanode = tail[-1].target if tail else target
+                inverse = tuple(edge.inverse for edge in reversed(tail))
+                tails_by_node.setdefault(metanode, list()).append(inverse)
+            for head in head_levels[head_length]:
+                for tail in tails_by_node.get(head[-1].target, list()):
+                    edge_tuples.append(head + tail)
+        return edge_tuples
+
+    def _grow_levels(self, start, end, depth, max_length):
+        """
+        Return a list where element i holds the partial metapaths of length i
+        from start which can still reach end within max_length metaedges.
+        """
+        distances = self.distances_to(end)
+        levels = [[tuple()]]
+        for i in range(depth):
+            remaining = max_length - i - 1
+            current = list()
+            for edges in levels[-1]:
+                metanode = edges[-1].target if edges else start
+                for add_edge in metanode.edges:
+                    if distances.get(add_edge.target, max_length + 1) > remaining:
+                        continue
+                    current.append(edges + (add_edge, ))
+            levels.append(current)
+        return levels
             
     def get_metapath(self, edges):
         """ """
@@ -291,17 +407,23 @@ class MetaGraph(BaseGraph):
     
     
 class MetaNode(BaseNode):
-    
+
+    __slots__ = ('masked', 'edges', 'abbrev')
+
     def __init__(self, id_):
         """ """
         BaseNode.__init__(self, id_)
+        ElemMask.__init__(self)
         self.edges = set()
 
 class MetaEdge(BaseEdge):
 
+    __slots__ = ('masked', 'kind', 'direction', 'hash_', 'inverse', 'inverted', 'kind_abbrev')
+
     def __init__(self, source, target, kind, direction):
         """source and target are MetaNodes."""
         BaseEdge.__init__(self, source, target)
+        ElemMask.__init__(self)
         self.kind = kind
         self.direction = direction
         self.hash_ = hash(self.get_id())
@@ -315,7 +437,9 @@ class MetaEdge(BaseEdge):
                                       self.kind_abbrev, self.direction)
 
 class MetaPath(BasePath):
-    
+
+    __slots__ = ('inverse', 'sub')
+
     def __init__(self, edges):
         """metaedges is a tuple of edges"""
         assert all(isinstance(edge, MetaEdge) for edge in edges)
@@ -332,6 +456,75 @@ class MetaPath(BasePath):
         return s
 
 
+class DegreeIndex(object):
+    """
+    Degrees of nodes keyed by (node, metaedge), counting the edges which
+    Node.get_edges returns: unmasked edges whose target is unmasked. Entries
+    are computed on first use and updated incrementally as masks change.
+    offsets holds the number of edges of a (node, metaedge) which are absent
+    from the graph because it is a subgraph, so that degrees remain those
+    of the graph it was extracted from.
+    """
+
+    def __init__(self, graph):
+        self.graph = graph
+        self.degrees = dict()
+        self.offsets = dict()
+
+    def degree(self, node, metaedge, exclude_masked=True):
+        offset = self.offsets.get((node, metaedge), 0) if self.offsets else 0
+        if not exclude_masked or not self.graph.has_masked():
+            return len(node.edges[metaedge]) + offset
+        key = node, metaedge
+        try:
+            return self.degrees[key] + offset
+        except KeyError:
+            degree = len(node.get_edges(metaedge))
+            self.degrees[key] = degree
+            return degree + offset
+
+    def adjustments(self, exclude_edges, exclude_masked=True):
+        """
+        Return a dict of (node, metaedge) to the number of exclude_edges
+        counted in that degree, to be subtracted when edges are excluded.
+        """
+        adjustments = dict()
+        graph = self.graph
+        check_masks = exclude_masked and graph.has_masked()
+        for edge in exclude_edges:
+            if check_masks and (edge.int_id in graph.edge_mask or
+                                edge.target.int_id in graph.node_mask):
+                continue
+            key = edge.source, edge.metaedge
+            adjustments[key] = adjustments.get(key, 0) + 1
+        return adjustments
+
+    def update(self, key, delta):
+        if key in self.degrees:
+            self.degrees[key] += delta
+
+    def edge_masked(self, edge, masked):
+        """Update for a change to the mask of edge."""
+        if edge.target.int_id not in self.graph.node_mask:
+            self.update((edge.source, edge.metaedge), -1 if masked else 1)
+
+    def node_masked(self, node, masked):
+        """Update for a change to the mask of node, the target of its inverse edges."""
+        edge_mask = self.graph.edge_mask
+        delta = -1 if masked else 1
+        for edges in node.edges.itervalues():
+            for edge in edges:
+                incoming = edge.inverse
+                if incoming.int_id not in edge_mask:
+                    self.update((incoming.source, incoming.metaedge), delta)
+
+    def edge_added(self, edge):
+        self.degrees.pop((edge.source, edge.metaedge), None)
+
+    def clear(self):
+        self.degrees = dict()
+
+
 class Tree(object):
 
     __slots__ = ('parent', 'edge') #, 'is_root', 'path_to_root')
@@ -362,38 +555,158 @@ class Tree(object):
 class Graph(BaseGraph):
     
     def __init__(self, metagraph, data=dict()):
-        """ """
+        """
+        Nodes and edges are numbered by int_id in order of addition and their
+        masks are stored as bitsets of int_ids in node_mask and edge_mask.
+        mask_version is incremented whenever the masks change, so results
+        which depend on the masks can be cached under it.
+        """
         BaseGraph.__init__(self)
         self.metagraph = metagraph
         self.data = data        
-
-    def add_node(self, id_, kind, data=dict()):
+        self.node_list = list()
+        self.edge_list = list()
+        self.node_mask = masking.Bitset()
+        self.edge_mask = masking.Bitset()
+        self.mask_sets = dict()
+        self.mask_version = 0
+        self.degree_index = DegreeIndex(self)
+
+    def add_node(self, id_, kind, data=None):
         """ """
         metanode = self.metagraph.node_dict[kind]
-        node = Node(id_, metanode, data)
+        node = Node(id_, metanode, data, self, len(self.node_list))
+        self.node_list.append(node)
         self.node_dict[id_] = node
         return node
     
-    def add_edge(self, source_id, target_id, kind, direction, data=dict()):
+    def add_edge(self, source_id, target_id, kind, direction, data=None):
         """ """
         source = self.node_dict[source_id]
         target = self.node_dict[target_id]
         metaedge_id = source.metanode.id_, target.metanode.id_, kind, direction
         metaedge = self.metagraph.edge_dict[metaedge_id]
-        edge = Edge(source, target, metaedge, data)
+        edge = Edge(source, target, metaedge, data, len(self.edge_list))
+        self.edge_list.append(edge)
         self.edge_dict[edge.get_id()] = edge
         edge.inverted = False
         
-        inverse = Edge(target, source, metaedge.inverse, data)
+        inverse = Edge(target, source, metaedge.inverse, data, len(self.edge_list))
+        self.edge_list.append(inverse)
         inverse_id = inverse.get_id()
         self.edge_dict[inverse_id] = inverse
         inverse.inverted = True
 
         edge.inverse = inverse
         inverse.inverse = edge
+
+        self.degree_index.edge_added(edge)
+        self.degree_index.edge_added(inverse)
         
         return edge, inverse
 
+    def add_nodes_from(self, ids, kinds=None, data=None):
+        """
+        Add nodes in bulk. Either ids is an iterable of (id_, kind) or
+        (id_, kind, data) tuples, or ids, kinds and data are parallel
+        sequences. kinds may also be a single kind shared by all nodes and
+        data may be omitted. Returns the list of added nodes.
+        """
+        if kinds is None:
+            rows = ids
+        else:
+            if isinstance(kinds, basestring):
+                kinds = itertools.repeat(kinds)
+            if data is None:
+                data = itertools.repeat(None)
+            rows = itertools.izip(ids, kinds, data)
+
+        metanode_dict = self.metagraph.node_dict
+        node_dict, node_list = self.node_dict, self.node_list
+        nodes = list()
+        for row in rows:
+            id_, kind = row[0], row[1]
+            node_data = row[2] if len(row) > 2 else None
+            node = Node(id_, metanode_dict[kind], node_data, self, len(node_list))
+            node_list.append(node)
+            node_dict[id_] = node
+            nodes.append(node)
+        return nodes
+
+    def add_edges_from(self, source_ids, target_ids=None, kinds=None,
+                       directions=None, data=None):
+        """
+        Add edges in bulk. Either source_ids is an iterable of (source_id,
+        target_id, kind, direction) tuples, optionally followed by data, or
+        the arguments are parallel sequences. kinds and directions may also
+        be single values shared by all edges and data may be omitted. Each
+        metaedge is resolved once per distinct combination of metanodes,
+        kind and direction. Returns the number of added edges.
+        """
+        if target_ids is None:
+            rows = source_ids
+        else:
+            if isinstance(kinds, basestring):
+                kinds = itertools.repeat(kinds)
+            if isinstance(directions, basestring):
+                directions = itertools.repeat(directions)
+            if data is None:
+                data = itertools.repeat(None)
+            rows = itertools.izip(source_ids, target_ids, kinds, directions, data)
+
+        # the cyclic garbage collector repeatedly scans the growing graph
+        # while millions of objects are allocated, so pause it during loading
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return self._add_edge_rows(rows)
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+    def _add_edge_rows(self, rows):
+        node_dict, edge_dict, edge_list = self.node_dict, self.edge_dict, self.edge_list
+        metaedge_dict = self.metagraph.edge_dict
+        resolved = dict()
+        n_edges = 0
+        for row in rows:
+            source_id, target_id, kind, direction = row[:4]
+            edge_data = row[4] if len(row) > 4 else None
+            source = node_dict[source_id]
+            target = node_dict[target_id]
+            resolve_key = source.metanode, target.metanode, kind, direction
+            try:
+                metaedge, inverse_direction = resolved[resolve_key]
+            except KeyError:
+                metaedge_id = source.metanode.id_, target.metanode.id_, kind, direction
+                metaedge = metaedge_dict[metaedge_id]
+                inverse_direction = metaedge.inverse.direction
+                resolved[resolve_key] = metaedge, inverse_direction
+
+            edge = Edge(source, target, metaedge, edge_data, len(edge_list))
+            edge_list.append(edge)
+            edge_dict[source_id, target_id, kind, direction] = edge
+            edge.inverted = False
+
+            inverse = Edge(target, source, metaedge.inverse, edge_data, len(edge_list))
+            edge_list.append(inverse)
+            edge_dict[target_id, source_id, kind, inverse_direction] = inverse
+            inverse.inverted = True
+
+            edge.inverse = inverse
+            inverse.inverse = edge
+            n_edges += 1
+
+        self.degree_index.clear()
+        return n_edges
+
+    def compile(self):
+        """
+        Return a CompiledGraph: a frozen, integer-indexed view of the graph
+        with numpy-backed CSR adjacency for each metaedge.
+        """
+        return compiled.CompiledGraph.from_graph(self)
+
     def paths_tree(self, source, metapath,
                    duplicates=False, masked=True,
                    exclude_nodes=set(), exclude_edges=set()):
@@ -414,6 +727,9 @@ class Graph(BaseGraph):
         if source in exclude_nodes:
             return None
 
+        check_masks = not masked and self.has_masked()
+        node_mask, edge_mask = self.node_mask, self.edge_mask
+
         leaves = list()
         for edge in source.edges[metapath[0]]:
             edge_target = edge.target
@@ -421,7 +737,7 @@ class Graph(BaseGraph):
                 continue
             if edge_target in exclude_nodes or edge in exclude_edges:
                 continue
-            if not masked and (edge_target.masked or edge.masked):
+            if check_masks and (edge_target.int_id in node_mask or edge.int_id in edge_mask):
                 continue
             tree = Tree(parent=None, edge=edge)
             leaves.append(tree)
@@ -437,7 +753,7 @@ class Graph(BaseGraph):
                         continue
                     if edge_target in exclude_nodes or edge in exclude_edges:
                         continue
-                    if not masked and (edge_target.masked or edge.masked):
+                    if check_masks and (edge_target.int_id in node_mask or edge.int_id in edge_mask):
                         continue
 
                     tree = Tree(parent=parent, edge=edge)
@@ -527,6 +843,9 @@ class Graph(BaseGraph):
         if source in exclude_nodes:
             return None
         
+        check_masks = not masked and self.has_masked()
+        node_mask, edge_mask = self.node_mask, self.edge_mask
+
         paths = list()
 
         for edge in source.edges[metapath[0]]:
@@ -535,7 +854,7 @@ class Graph(BaseGraph):
                 continue
             if edge in exclude_edges:
                 continue
-            if not masked and (edge_target.masked or edge.masked):
+            if check_masks and (edge_target.int_id in node_mask or edge.int_id in edge_mask):
                 continue
             if not duplicates and edge_target == source:
                 continue
@@ -554,7 +873,7 @@ class Graph(BaseGraph):
                         continue
                     if edge in exclude_edges:
                         continue
-                    if not masked and (edge_target.masked or edge.masked):
+                    if check_masks and (edge_target.int_id in node_mask or edge.int_id in edge_mask):
                         continue
                     if not duplicates and edge_target in nodes:
                         continue
@@ -566,12 +885,13 @@ class Graph(BaseGraph):
     
     def paths_between(self, source, target, metapath,
                       duplicates=False, masked=True,
-                      exclude_nodes=set(), exclude_edges=set()):
+                      exclude_nodes=set(), exclude_edges=set(),
+                      split_index=None):
         """
         Retreive the paths starting with the node source and ending on the
-        node target. Future implementations should split the metapath, computing
-        paths_from the source and target and look for the intersection at the
-        intermediary Node position.
+        node target. The metapath is split at split_index (by default its
+        midpoint): paths_from the source and target are computed for each
+        part and joined at the intermediary Node position.
         """
         if len(metapath) <= 1:
             paths = self.paths_from(source, metapath, duplicates, masked,
@@ -580,7 +900,9 @@ class Graph(BaseGraph):
             return paths
         
         
-        split_index = len(metapath) / 2
+        if split_index is None:
+            split_index = len(metapath) / 2
+        assert 0 < split_index < len(metapath)
 
         get_metapath = self.metagraph.get_metapath
         metapath_head = get_metapath(metapath[:split_index])
@@ -619,11 +941,164 @@ class Graph(BaseGraph):
         return paths        
     
     
+    def iter_paths_from(self, source, metapath,
+                        duplicates=False, masked=True,
+                        exclude_nodes=set(), exclude_edges=set(),
+                        limit=None, target=None):
+        """
+        Generator variant of paths_from which yields Paths depth-first rather
+        than building all paths level by level. Only the current path is held
+        in memory, so memory is bounded by the metapath length rather than the
+        number of results. Iteration stops after limit paths when limit is not
+        None. Setting target restricts the yielded paths to those terminating
+        on target, pruning the final step to the neighbors of target.
+        """
+        if not isinstance(source, Node):
+            source = self.node_dict[source]
+
+        if masked and source.masked:
+            return
+
+        if source in exclude_nodes:
+            return
+
+        if limit is not None and limit <= 0:
+            return
+
+        length = len(metapath)
+        penultimate = None
+        if target is not None:
+            if not isinstance(target, Node):
+                target = self.node_dict[target]
+            penultimate = {edge.target for edge in target.edges[metapath[-1].inverse]}
+
+        check_masks = not masked and self.has_masked()
+        node_mask, edge_mask = self.node_mask, self.edge_mask
+
+        nodes = [source]
+        edges = list()
+        iterators = [iter(source.edges[metapath[0]])]
+        n_paths = 0
+        while iterators:
+            depth = len(edges)
+            for edge in iterators[-1]:
+                edge_target = edge.target
+                if edge_target in exclude_nodes:
+                    continue
+                if edge in exclude_edges:
+                    continue
+                if check_masks and (edge_target.int_id in node_mask or edge.int_id in edge_mask):
+                    continue
+                if not duplicates and edge_target in nodes:
+                    continue
+                if depth + 1 == length:
+                    if target is not None and edge_target != target:
+                        continue
+                    yield Path(tuple(edges) + (edge, ))
+                    n_paths += 1
+                    if limit is not None and n_paths >= limit:
+                        return
+                    continue
+                if penultimate is not None and depth + 2 == length and edge_target not in penultimate:
+                    continue
+                nodes.append(edge_target)
+                edges.append(edge)
+                iterators.append(iter(edge_target.edges[metapath[depth + 1]]))
+                break
+            else:
+                iterators.pop()
+                if edges:
+                    edges.pop()
+                    nodes.pop()
+
+    def iter_paths_between(self, source, target, metapath,
+                           duplicates=False, masked=True,
+                           exclude_nodes=set(), exclude_edges=set(),
+                           limit=None):
+        """
+        Generator variant of paths_between which yields Paths from source to
+        target depth-first, stopping after limit paths when limit is not None.
+        """
+        return self.iter_paths_from(source, metapath, duplicates, masked,
+                                    exclude_nodes, exclude_edges, limit, target)
+
+    def has_path(self, source, target, metapath,
+                 duplicates=False, masked=True,
+                 exclude_nodes=set(), exclude_edges=set()):
+        """Return whether any path following metapath joins source and target."""
+        paths = self.iter_paths_between(source, target, metapath, duplicates, masked,
+                                        exclude_nodes, exclude_edges, limit=1)
+        return any(True for path in paths)
+
+    def set_node_masked(self, int_id, masked):
+        """Set whether the node int_id is masked. Returns whether this changed."""
+        changed = self.node_mask.set(int_id, masked)
+        if changed:
+            self.mask_version += 1
+            self.degree_index.node_masked(self.node_list[int_id], masked)
+        return changed
+
+    def set_edge_masked(self, int_id, masked):
+        """Set whether the edge int_id is masked. Returns whether this changed."""
+        changed = self.edge_mask.set(int_id, masked)
+        if changed:
+            self.mask_version += 1
+            self.degree_index.edge_masked(self.edge_list[int_id], masked)
+        return changed
+
+    def degree(self, node, metaedge, exclude_masked=True):
+        """
+        Return the number of metaedge edges incident to node, which excludes
+        masked edges and edges to masked nodes when exclude_masked is True.
+        """
+        return self.degree_index.degree(node, metaedge, exclude_masked)
+
+    def has_masked(self):
+        """Return whether any node or edge is masked."""
+        return bool(self.node_mask.count or self.edge_mask.count)
+
+    def add_mask_set(self, name, nodes=(), edges=()):
+        """Store the nodes and edges to mask as a named MaskSet."""
+        mask_set = masking.MaskSet(name, nodes, edges)
+        self.mask_sets[name] = mask_set
+        return mask_set
+
+    def masking(self, name=None, nodes=(), edges=()):
+        """
+        Return a context manager which masks the named mask set and the
+        specified nodes and edges, restoring the prior masking on exit in time
+        proportional to the number of elements it changed.
+        """
+        node_ids = [node.int_id for node in nodes]
+        edge_ids = [edge.int_id for edge in edges]
+        if name is not None:
+            mask_set = self.mask_sets[name]
+            node_ids.extend(mask_set.nodes)
+            edge_ids.extend(mask_set.edges)
+        return masking.MaskContext(self, node_ids, edge_ids)
+
+    def paths_masked(self, paths):
+        """
+        Return a numpy boolean array indicating whether each path, given as
+        a tuple of Edges, traverses a masked node or edge. Paths must have
+        equal length, as is the case for paths following the same metapath.
+        """
+        if not paths or not paths[0] or not self.has_masked():
+            return numpy.zeros(len(paths), dtype=bool)
+        edge_ids = numpy.array([[edge.int_id for edge in path] for path in paths])
+        node_ids = numpy.array([[path[0].source.int_id] + [edge.target.int_id for edge in path]
+                                for path in paths])
+        edge_masked = self.edge_mask.to_array(len(self.edge_list))[edge_ids]
+        node_masked = self.node_mask.to_array(len(self.node_list))[node_ids]
+        return edge_masked.any(axis=1) | node_masked.any(axis=1)
+
     def unmask(self):
         """Unmask all nodes and edges contained within the graph"""
-        for dictionary in self.node_dict, self.edge_dict:
-            for value in dictionary.itervalues():
-                value.masked = False
+        if self.has_masked():
+            self.mask_version += 1
+        self.node_mask.clear()
+        self.edge_mask.clear()
+        self.degree_index.clear()
         
     def get_metanode_to_nodes(self):
         metanode_to_nodes = dict()
@@ -639,47 +1114,150 @@ class Graph(BaseGraph):
             metaedge_to_edges.setdefault(metaedge, list()).append(edge)
         return metaedge_to_edges
 
+    def subgraph(self, nodes):
+        """
+        Return a Graph, sharing this graph's metagraph, of the specified
+        nodes (Nodes or node ids) and the edges between them. Masking is
+        copied. Degrees are preserved: edges to nodes outside the subgraph
+        are recorded as degree offsets, so degree weighting in the subgraph
+        matches this graph. Offsets count edges leaving the subgraph as
+        unmasked.
+        """
+        nodes = {node if isinstance(node, Node) else self.node_dict[node] for node in nodes}
+        nodes = sorted(nodes, key=lambda node: node.int_id)
+        node_set = set(nodes)
+
+        subgraph = Graph(self.metagraph, self.data)
+        subgraph.add_nodes_from((node.id_, node.metanode.id_, node._data) for node in nodes)
+
+        edge_rows = list()
+        offsets = subgraph.degree_index.offsets
+        parent_offsets = self.degree_index.offsets
+        for node in nodes:
+            subnode = subgraph.node_dict[node.id_]
+            for metaedge, edges in node.edges.iteritems():
+                n_outside = parent_offsets.get((node, metaedge), 0)
+                for edge in edges:
+                    if edge.target not in node_set:
+                        n_outside += 1
+                    elif not edge.inverted:
+                        edge_rows.append(edge.get_id() + (edge._data, ))
+                if n_outside:
+                    offsets[subnode, metaedge] = n_outside
+        subgraph.add_edges_from(edge_rows)
+
+        for node in nodes:
+            if node.masked:
+                subgraph.node_dict[node.id_].masked = True
+        for edge in self.get_masked_edges():
+            if edge.source in node_set and edge.target in node_set:
+                subgraph.edge_dict[edge.get_id()].masked = True
+        return subgraph
+
+    def get_masked_edges(self):
+        """Return a list of the masked edges."""
+        return [self.edge_list[int_id] for int_id in self.edge_mask]
+
 
     
 class Node(BaseNode):
-    
-    def __init__(self, id_, metanode, data):
-        """ """
+
+    __slots__ = ('metanode', '_data', 'edges', 'graph', 'int_id')
+
+    def __init__(self, id_, metanode, data, graph, int_id):
+        """
+        graph is the Graph containing the node, which stores its mask. data
+        may be None, in which case a dict is only created when data is used.
+        """
+        self.graph = graph
+        self.int_id = int_id
         BaseNode.__init__(self, id_)
         self.metanode = metanode
-        self.data = data
-        self.edges = {metaedge: set() for metaedge in metanode.edges}
+        self._data = data
+        self.edges = {metaedge: empty_edges for metaedge in metanode.edges}
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = dict()
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        self._data = data
+
+    @property
+    def masked(self):
+        return self.int_id in self.graph.node_mask
+
+    @masked.setter
+    def masked(self, masked):
+        self.graph.set_node_masked(self.int_id, masked)
 
     def get_edges(self, metaedge, exclude_masked=True):
         """
         Returns the set of edges incident to self of the specified metaedge.
         """
         if exclude_masked:
-            edges = set()
-            for edge in self.edges[metaedge]:
-                if edge.masked or edge.target.masked:
-                    continue
-                edges.add(edge)
+            graph = self.graph
+            if not graph.has_masked():
+                return set(self.edges[metaedge])
+            node_mask, edge_mask = graph.node_mask, graph.edge_mask
+            edges = {edge for edge in self.edges[metaedge]
+                     if edge.int_id not in edge_mask and edge.target.int_id not in node_mask}
         else:
             edges = self.edges[metaedge]
         return edges
 
 class Edge(BaseEdge):
-    
-    def __init__(self, source, target, metaedge, data):
+
+    __slots__ = ('metaedge', '_data', 'inverse', 'inverted', 'int_id')
+
+    def __init__(self, source, target, metaedge, data, int_id):
         """source and target are Node objects. metaedge is the MetaEdge object
-        representing the edge
+        representing the edge. data may be None, in which case a dict, shared
+        with the inverse edge, is only created when data is used.
         """
+        self.int_id = int_id
         BaseEdge.__init__(self, source, target)
         self.metaedge = metaedge
-        self.data = data
-        self.source.edges[metaedge].add(self)
+        self._data = data
+        source_edges = self.source.edges
+        if source_edges[metaedge] is empty_edges:
+            source_edges[metaedge] = set()
+        source_edges[metaedge].add(self)
     
+    def __hash__(self):
+        return self.int_id
+
+    @property
+    def data(self):
+        if self._data is None:
+            inverse = self.inverse
+            if inverse._data is None:
+                inverse._data = dict()
+            self._data = inverse._data
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        self._data = data
+
+    @property
+    def masked(self):
+        return self.int_id in self.source.graph.edge_mask
+
+    @masked.setter
+    def masked(self, masked):
+        self.source.graph.set_edge_masked(self.int_id, masked)
+
     def get_id(self):
         return self.source.id_, self.target.id_, self.metaedge.kind, self.metaedge.direction
         
 class Path(BasePath):
-    
+
+    __slots__ = ()
+
     def __init__(self, edges):
         """potentially metapath should be an input although it can be calculated"""
         BasePath.__init__(self, edges)
@@ -0,0 +1,139 @@
+import collections
+import heapq
+import json
+import sys
+import time
+
+
+class Instrumentation(object):
+    """
+    Opt-in counters and timers for the path computations, keyed by
+    operation and metapath. Instrumented code checks enabled before
+    recording, so a disabled Instrumentation costs one attribute lookup.
+    The n_slowest slowest timed calls are kept along with their node, to
+    identify hubs.
+    """
+
+    def __init__(self, enabled=False, n_slowest=10):
+        self.enabled = enabled
+        self.n_slowest = n_slowest
+        self.reset()
+
+    def reset(self):
+        self.seconds = collections.Counter()
+        self.calls = collections.Counter()
+        self.counters = collections.Counter()
+        self.slowest = list()
+
+    def count(self, operation, metapath, name, n=1):
+        """Add n to the counter name of operation on metapath."""
+        self.counters[operation, str(metapath), name] += n
+
+    def record(self, operation, metapath, seconds, node=None):
+        """Record a call of operation on metapath which took seconds."""
+        key = operation, str(metapath)
+        self.seconds[key] += seconds
+        self.calls[key] += 1
+        item = seconds, operation, str(metapath), str(node)
+        if len(self.slowest) < self.n_slowest:
+            heapq.heappush(self.slowest, item)
+        elif seconds > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, item)
+
+    def timer(self, operation, metapath=None, node=None):
+        """Return a context manager which records the duration of its block."""
+        return Timer(self, operation, metapath, node)
+
+    def summary(self):
+        """
+        Return a dict of metapath to operation to statistics: seconds,
+        calls and the counters of that operation and metapath.
+        """
+        summary = collections.defaultdict(lambda: collections.defaultdict(dict))
+        for (operation, metapath), seconds in self.seconds.items():
+            statistics = summary[metapath][operation]
+            statistics['seconds'] = seconds
+            statistics['calls'] = self.calls[operation, metapath]
+        for (operation, metapath, name), n in self.counters.items():
+            summary[metapath][operation][name] = n
+        return {metapath: dict(operations) for metapath, operations in summary.items()}
+
+    def report(self, write_file=None):
+        """Write a table of the summary, slowest metapaths first, and the slowest calls."""
+        write_file = write_file or sys.stdout
+        summary = self.summary()
+        def total_seconds(metapath):
+            return sum(statistics.get('seconds', 0.0) for statistics in summary[metapath].values())
+        write_file.write('{:40}{:28}{:>10}{:>10}  {}\n'.format(
+            'metapath', 'operation', 'seconds', 'calls', 'counters'))
+        for metapath in sorted(summary, key=total_seconds, reverse=True):
+            for operation, statistics in sorted(summary[metapath].items()):
+                counters = ', '.join('{} {}'.format(name, n) for name, n in sorted(statistics.items())
+                                     if name not in ('seconds', 'calls'))
+                write_file.write('{:40}{:28}{:>10.3f}{:>10}  {}\n'.format(
+                    metapath, operation, statistics.get('seconds', 0.0),
+                    statistics.get('calls', 0), counters))
+        write_file.write('slowest calls\n')
+        for seconds, operation, metapath, node in sorted(self.slowest, reverse=True):
+            write_file.write('{:10.3f}  {} {} from {}\n'.format(seconds, operation, metapath, node))
+
+    def dump(self, path):
+        """Write the summary and slowest calls to path as JSON."""
+        slowest = [{'seconds': seconds, 'operation': operation, 'metapath': metapath, 'node': node}
+                   for seconds, operation, metapath, node in sorted(self.slowest, reverse=True)]
+        with open(path, 'w') as write_file:
+            json.dump({'summary': self.summary(), 'slowest': slowest},
+                      write_file, indent=2, sort_keys=True)
+
+
+class Timer(object):
+
+    def __init__(self, instrumentation, operation, metapath, node):
+        self.instrumentation = instrumentation
+        self.operation = operation
+        self.metapath = metapath
+        self.node = node
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        if self.instrumentation.enabled:
+            self.instrumentation.record(self.operation, self.metapath,
+                                        time.time() - self.start, self.node)
+
+
+class Progress(object):
+    """
+    Throttled progress reporting: update prints at most once every interval
+    seconds, and always for the final item.
+    """
+
+    def __init__(self, total, interval=30.0, start=0, write_file=None):
+        self.total = total
+        self.interval = interval
+        self.start = start
+        self.write_file = write_file or sys.stdout
+        self.time_start = time.time()
+        self.time_reported = None
+
+    def update(self, completed, message=''):
+        """Report that completed of total items are done."""
+        now = time.time()
+        if (completed < self.total and self.time_reported is not None and
+                now - self.time_reported < self.interval):
+            return False
+        self.time_reported = now
+        elapsed = now - self.time_start
+        rate = (completed - self.start) / elapsed if elapsed > 0 else 0.0
+        remaining = (self.total - completed) / rate if rate > 0 else float('nan')
+        percent = 100.0 * completed / self.total if self.total else 100.0
+        self.write_file.write('{:.1f}% | {} of {} | {:.2f} per second | {:.0f} seconds remaining{}\n'.format(
+            percent, completed, self.total, rate, remaining, ' | ' + message if message else ''))
+        self.write_file.flush()
+        return True
+
+
+# the Instrumentation which pathtools records to, disabled by default
+instruments = Instrumentation()
@@ -0,0 +1,135 @@
+import numpy
+
+
+class Bitset(object):
+    """
+    Set of non-negative integers stored as one bit per integer in a
+    bytearray, which grows as larger integers are added. The boolean array
+    of to_array is cached in unpacked until the bitset next changes.
+    """
+
+    __slots__ = ('bits', 'count', 'unpacked')
+
+    def __init__(self, integers=()):
+        self.bits = bytearray()
+        self.count = 0
+        self.unpacked = None
+        for i in integers:
+            self.add(i)
+
+    def __contains__(self, i):
+        byte = i >> 3
+        return byte < len(self.bits) and bool(self.bits[byte] & (1 << (i & 7)))
+
+    __getitem__ = __contains__
+
+    def add(self, i):
+        """Add i, returning True if it was not already present."""
+        byte, bit = i >> 3, 1 << (i & 7)
+        if byte >= len(self.bits):
+            self.bits.extend(bytearray(byte + 1 - len(self.bits)))
+        if self.bits[byte] & bit:
+            return False
+        self.bits[byte] |= bit
+        self.count += 1
+        self.unpacked = None
+        return True
+
+    def discard(self, i):
+        """Remove i, returning True if it was present."""
+        byte, bit = i >> 3, 1 << (i & 7)
+        if byte >= len(self.bits) or not self.bits[byte] & bit:
+            return False
+        self.bits[byte] &= ~bit & 0xFF
+        self.count -= 1
+        self.unpacked = None
+        return True
+
+    def set(self, i, value):
+        return self.add(i) if value else self.discard(i)
+
+    def clear(self):
+        self.bits = bytearray(len(self.bits))
+        self.count = 0
+        self.unpacked = None
+
+    def copy(self):
+        bitset = Bitset()
+        bitset.bits = bytearray(self.bits)
+        bitset.count = self.count
+        return bitset
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for byte, value in enumerate(self.bits):
+            if not value:
+                continue
+            for bit in range(8):
+                if value & (1 << bit):
+                    yield (byte << 3) | bit
+
+    def to_array(self, size):
+        """
+        Return a read-only numpy boolean array of length size indexed by
+        integer. The bits are only unpacked again after the bitset changes.
+        """
+        # bitsets pickled before unpacked was added lack the slot
+        unpacked = getattr(self, 'unpacked', None)
+        if unpacked is None:
+            bits = numpy.frombuffer(bytes(self.bits), dtype=numpy.uint8)
+            # unpack least significant bit first so that position i holds integer i
+            unpacked = numpy.unpackbits(bits[:, numpy.newaxis], axis=1)[:, ::-1].ravel().astype(bool)
+            unpacked.flags.writeable = False
+            self.unpacked = unpacked
+        if len(unpacked) < size:
+            # keep the padded array, as callers ask for the same size each time
+            unpacked = numpy.concatenate([unpacked, numpy.zeros(size - len(unpacked), dtype=bool)])
+            unpacked.flags.writeable = False
+            self.unpacked = unpacked
+        return unpacked[:size]
+
+    def contains_any(self, integers):
+        """Vectorized test of whether any of an array of integers is present."""
+        integers = numpy.asarray(integers)
+        if not self.count or not integers.size:
+            return False
+        return bool(self.to_array(int(integers.max()) + 1)[integers].any())
+
+
+class MaskSet(object):
+    """A named set of masked nodes and edges, stored as bitsets of int_ids."""
+
+    def __init__(self, name, nodes=(), edges=()):
+        self.name = name
+        self.nodes = Bitset(node.int_id for node in nodes)
+        self.edges = Bitset(edge.int_id for edge in edges)
+
+
+class MaskContext(object):
+    """
+    Context manager which masks nodes and edges of a graph on entry and, on
+    exit, unmasks only the elements it changed. Elements which were already
+    masked on entry remain masked, so contexts can be nested.
+    """
+
+    def __init__(self, graph, node_ids=(), edge_ids=()):
+        self.graph = graph
+        self.node_ids = node_ids
+        self.edge_ids = edge_ids
+        self.changed_nodes = list()
+        self.changed_edges = list()
+
+    def __enter__(self):
+        graph = self.graph
+        self.changed_nodes = [i for i in self.node_ids if graph.set_node_masked(i, True)]
+        self.changed_edges = [i for i in self.edge_ids if graph.set_edge_masked(i, True)]
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        graph = self.graph
+        for i in self.changed_nodes:
+            graph.set_node_masked(i, False)
+        for i in self.changed_edges:
+            graph.set_edge_masked(i, False)
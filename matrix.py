@@ -0,0 +1,136 @@
+import numpy
+import scipy.sparse
+
+
+def _cached(compiled, key, compute):
+    """Return compiled.matrix_cache[key], computing it with compute() if absent."""
+    try:
+        return compiled.matrix_cache[key]
+    except KeyError:
+        value = compute()
+        compiled.matrix_cache[key] = value
+        return value
+
+def degree_weighted_matrix(compiled, metaedge, damping_exponent):
+    """
+    Return the adjacency matrix of metaedge as a scipy.sparse.csr_matrix
+    where each edge is weighted by (source degree * target degree) raised
+    to -damping_exponent. A path's DWPC weight is the product of the weights
+    of its edges, so products of these matrices sum path weights. Matrices
+    are cached on compiled.
+    """
+    key = 'weighted', metaedge.get_id(), damping_exponent
+    return _cached(compiled, key, lambda: _degree_weighted_matrix(compiled, metaedge, damping_exponent))
+
+def _degree_weighted_matrix(compiled, metaedge, damping_exponent):
+    metaedge_id = metaedge.get_id()
+    indptr = compiled.indptr[metaedge_id]
+    indices = compiled.indices[metaedge_id]
+    source_degrees = compiled.degree_dict[metaedge_id]
+    target_degrees = compiled.degree_dict[metaedge.inverse.get_id()]
+    source_weights = _inverse_power(source_degrees, damping_exponent)
+    target_weights = _inverse_power(target_degrees, damping_exponent)
+    data = numpy.repeat(source_weights, numpy.diff(indptr)) * target_weights[indices]
+    shape = len(source_degrees), len(target_degrees)
+    return scipy.sparse.csr_matrix((data, indices, indptr), shape=shape)
+
+def _inverse_power(degrees, damping_exponent):
+    weights = numpy.zeros(len(degrees), dtype=numpy.float64)
+    nonzero = degrees > 0
+    weights[nonzero] = degrees[nonzero].astype(numpy.float64) ** -damping_exponent
+    return weights
+
+def dwpc_matrix(compiled, metapath, damping_exponent, rows=None):
+    """
+    Compute the degree-weighted path count between all sources and targets
+    of metapath using sparse matrix products. rows optionally restricts the
+    sources to an array of source indices, in which case row i of the result
+    corresponds to source rows[i]. Walks are corrected by inclusion-exclusion
+    to exclude paths with repeated nodes, following the semantics of
+    pathtools.crdfs_paths_from where consecutive repeats are permitted.
+    Supports metapaths of length 1 through 3. Returns a csr_matrix.
+    """
+    length = len(metapath)
+    if not 1 <= length <= 3:
+        raise ValueError('matrix DWPC supports metapaths of length 1 to 3')
+    kinds = [metapath[0].source.id_] + [metaedge.target.id_ for metaedge in metapath]
+    matrices = [degree_weighted_matrix(compiled, metaedge, damping_exponent)
+                for metaedge in metapath]
+    if rows is None:
+        rows = numpy.arange(matrices[0].shape[0])
+    rows = numpy.asarray(rows, dtype=numpy.int64)
+    positions = numpy.arange(len(rows))
+    head = matrices[0][rows, :]
+
+    if length == 1:
+        return head
+
+    if length == 2:
+        product = head * matrices[1]
+        if kinds[0] == kinds[2]:
+            product = _remove_entries(product, positions, rows)
+        return product
+
+    first, second, third = matrices
+    product = head * second * third
+    if kinds[0] == kinds[2]:
+        # walks returning to the source at the second hop: s, b, s, t
+        returns = numpy.asarray((head * second)[positions, rows]).ravel()
+        product = product - scipy.sparse.diags(returns) * third[rows, :]
+    if kinds[1] == kinds[3]:
+        # walks returning to the first intermediate node: s, t, c, t
+        key = 'diagonal', tuple(metaedge.get_id() for metaedge in metapath[1:]), damping_exponent
+        returns = _cached(compiled, key, lambda: (second * third).diagonal())
+        product = product - head * scipy.sparse.diags(returns)
+    if kinds[0] == kinds[2] and kinds[1] == kinds[3]:
+        # walks of the form s, t, s, t were subtracted twice
+        product = product + head.multiply(second.T.tocsr()[rows, :]).multiply(third[rows, :])
+    if kinds[0] == kinds[3]:
+        product = _remove_entries(product, positions, rows)
+    product = product.tocsr()
+    product.eliminate_zeros()
+    return product
+
+def _remove_entries(matrix, rows, columns):
+    """Return matrix with the entries at (rows[i], columns[i]) set to zero."""
+    matrix = matrix.tocsr()
+    values = numpy.asarray(matrix[rows, columns]).ravel()
+    entries = scipy.sparse.csr_matrix((values, (rows, columns)), shape=matrix.shape)
+    matrix = matrix - entries
+    matrix.eliminate_zeros()
+    return matrix
+
+def path_count_matrix(compiled, metapath, rows=None):
+    """Compute path counts between all sources and targets of metapath."""
+    return dwpc_matrix(compiled, metapath, 0.0, rows)
+
+def dwpc(compiled, source, target, metapath, damping_exponent):
+    """
+    Return the DWPC between source and target (Nodes or node ids) using the
+    matrix engine. Equivalent to pathtools.degree_weighted_path_count applied
+    to pathtools.crdfs_paths_fromto without exclusions, with
+    exclude_masked=False as the degrees of compiled ignore masks.
+    """
+    source_index = compiled.get_index(source, metapath[0].source.id_)
+    target_index = compiled.get_index(target, metapath[-1].target.id_)
+    row = dwpc_matrix(compiled, metapath, damping_exponent, rows=[source_index])
+    return float(row[0, target_index])
+
+def dwpc_row(compiled, source, metapath, damping_exponent, sparse=False):
+    """
+    Compute the DWPC and path count from source (a Node or node id) to every
+    target of metapath in one pass. Returns a (dwpc, path_count) tuple of
+    vectors indexed by target index, so that compiled.node_ids[kind][i] is
+    the id of the target of element i. Vectors are dense numpy arrays unless
+    sparse is True, in which case they are 1 x n csr_matrix rows. Degree-
+    weighted matrices are cached on compiled, so scoring many sources against
+    all targets costs one sparse row product per source and metapath.
+    pathtools.dwpcs_from computes the same values on the Graph itself, as a
+    dict of the reachable targets, with degrees which exclude masked edges.
+    """
+    source_index = compiled.get_index(source, metapath[0].source.id_)
+    dwpc = dwpc_matrix(compiled, metapath, damping_exponent, rows=[source_index])
+    path_count = path_count_matrix(compiled, metapath, rows=[source_index])
+    if sparse:
+        return dwpc, path_count
+    return dwpc.toarray().ravel(), path_count.toarray().ravel()
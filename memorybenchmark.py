@@ -0,0 +1,61 @@
+import argparse
+import gc
+import random
+
+import hetnet
+import hetnet.pathtools
+
+
+def memory_bytes():
+    gc.collect()
+    return hetnet.pathtools.memory_usage() * 2 ** 20
+
+def benchmark(n_nodes, n_edges, seed=0):
+    """
+    Build a random gene-disease graph and return the resident memory growth
+    in bytes per node and bytes per edge (each edge counted once, although
+    Graph stores it alongside its inverse).
+    """
+    metaedges = [('gene', 'disease', 'association', 'both'),
+                 ('gene', 'gene', 'interaction', 'both')]
+    metagraph = hetnet.MetaGraph.from_edge_tuples(metaedges)
+    random.seed(seed)
+    n_diseases = max(n_nodes / 100, 1)
+    diseases = ['D{}'.format(i) for i in xrange(n_diseases)]
+    genes = ['G{}'.format(i) for i in xrange(n_nodes - n_diseases)]
+    edge_tuples = set()
+    while len(edge_tuples) < n_edges:
+        source = random.choice(genes)
+        if random.random() < 0.1:
+            edge_tuples.add((source, random.choice(diseases), 'association'))
+        else:
+            target = random.choice(genes)
+            if source < target:
+                edge_tuples.add((source, target, 'interaction'))
+    edge_tuples = list(edge_tuples)
+
+    graph = hetnet.Graph(metagraph)
+    start = memory_bytes()
+    for disease in diseases:
+        graph.add_node(disease, 'disease')
+    for gene in genes:
+        graph.add_node(gene, 'gene')
+    after_nodes = memory_bytes()
+    for source, target, kind in edge_tuples:
+        graph.add_edge(source, target, kind, 'both')
+    after_edges = memory_bytes()
+
+    return {'bytes_per_node': (after_nodes - start) / n_nodes,
+            'bytes_per_edge': (after_edges - after_nodes) / n_edges}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nodes', default=100000, type=int)
+    parser.add_argument('--edges', default=1000000, type=int)
+    args = parser.parse_args()
+
+    result = benchmark(args.nodes, args.edges)
+    print('nodes {} | edges {}'.format(args.nodes, args.edges))
+    print('bytes per node {:.1f}'.format(result['bytes_per_node']))
+    print('bytes per edge {:.1f}'.format(result['bytes_per_edge']))
@@ -0,0 +1,203 @@
+import collections
+import heapq
+import sys
+
+import hetnet
+
+
+def estimate_size(value):
+    """
+    Estimate the bytes held by value, recursing into tuples, lists and dict
+    values. Nodes and edges are shared with the graph, so they only count
+    as the references which hold them. Objects with an estimate_size
+    method, such as PathDAGs, estimate their own size.
+    """
+    if isinstance(value, (hetnet.BaseNode, hetnet.BaseEdge)):
+        return 0
+    if hasattr(value, 'estimate_size'):
+        return value.estimate_size()
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        for element in value.itervalues():
+            size += estimate_size(element)
+    elif isinstance(value, (tuple, list)):
+        for element in value:
+            size += estimate_size(element)
+    return size
+
+
+class PathCache(object):
+    """
+    Cache whose entries are sized by sizeof and whose total size never
+    exceeds max_bytes. When storing an entry would exceed the budget,
+    entries are evicted according to policy:
+
+    'lru' evicts the least recently used entry.
+    'cost' evicts by GreedyDual-Size: each entry has a priority of its
+    compute cost per byte plus an inflation value, which rises to the
+    priority of each evicted entry. Entries which were expensive to compute
+    for their size are kept, and unused entries age out.
+
+    An entry may depend on other entries whose values it references, such
+    as a PathDAG on the PathDAGs of its tails. It is only stored while its
+    dependencies are, and removing a dependency removes its dependents, so
+    every value kept alive by the cache is counted in bytes. An entry with
+    dependents is pinned, so that it is not evicted from under entries in
+    use: neither policy evicts it until its last dependent is removed.
+
+    hits and misses count get calls, evictions counts evicted entries and
+    bytes is the current estimated size.
+    """
+
+    policies = 'lru', 'cost'
+
+    def __init__(self, max_bytes=60 * 2 ** 30, policy='lru', sizeof=estimate_size):
+        if policy not in self.policies:
+            raise ValueError('policy must be one of {}'.format(', '.join(self.policies)))
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.sizeof = sizeof
+        self.clear()
+
+    def clear(self):
+        """Remove every entry and reset the statistics."""
+        # key to (value, size, cost), in least to most recently used order,
+        # for entries without dependents, and for pinned entries with them
+        self.entries = collections.OrderedDict()
+        self.pinned = dict()
+        # key to the keys it depends on, and key to the keys depending on it
+        self.dependencies = dict()
+        self.dependents = dict()
+        self.priorities = dict()
+        self.heap = list()
+        self.inflation = 0.0
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key):
+        return key in self.entries or key in self.pinned
+
+    def __len__(self):
+        return len(self.entries) + len(self.pinned)
+
+    def __getitem__(self, key):
+        """Return the value of key without updating recency or statistics."""
+        try:
+            return self.entries[key][0]
+        except KeyError:
+            return self.pinned[key][0]
+
+    def get(self, key, default=None):
+        """Return the value of key, or default if absent, recording a hit or miss."""
+        try:
+            entry = self.entries.pop(key)
+        except KeyError:
+            entry = self.pinned.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return entry[0]
+        self.hits += 1
+        self.entries[key] = entry
+        if self.policy == 'cost':
+            value, size, cost = entry
+            self._prioritize(key, size, cost)
+        return entry[0]
+
+    def set(self, key, value, cost=1.0, depends=(), size=None):
+        """
+        Store value under key. cost is the effort of computing value, such
+        as seconds, and is only used by the 'cost' policy. depends lists the
+        keys of the entries which value references. size overrides
+        sizeof(value). Returns False if value is not stored, because it
+        alone exceeds max_bytes or an entry in depends is absent.
+        """
+        self.discard(key)
+        if size is None:
+            size = self.sizeof(value)
+        if size > self.max_bytes:
+            return False
+        while self.bytes + size > self.max_bytes:
+            self._evict()
+        depends = frozenset(depends)
+        if not all(dependency in self for dependency in depends):
+            return False
+        self.entries[key] = value, size, cost
+        self.bytes += size
+        if depends:
+            self.dependencies[key] = depends
+            for dependency in depends:
+                dependents = self.dependents.get(dependency)
+                if dependents is None:
+                    dependents = self.dependents[dependency] = set()
+                    self.pinned[dependency] = self.entries.pop(dependency)
+                    self.priorities.pop(dependency, None)
+                dependents.add(key)
+        if self.policy == 'cost':
+            self._prioritize(key, size, cost)
+        return True
+
+    def discard(self, key):
+        """
+        Remove key and the entries depending on it, if present, without
+        counting an eviction. Returns the number of entries removed.
+        """
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            entry = self.pinned.pop(key, None)
+            if entry is None:
+                return 0
+        self.bytes -= entry[1]
+        self.priorities.pop(key, None)
+        for dependency in self.dependencies.pop(key, ()):
+            # absent when key is being removed as a dependent of dependency
+            dependents = self.dependents.get(dependency)
+            if dependents is not None:
+                dependents.discard(key)
+                if not dependents:
+                    # unpin dependency as the most recently used entry
+                    del self.dependents[dependency]
+                    dependency_entry = self.entries[dependency] = self.pinned.pop(dependency)
+                    if self.policy == 'cost':
+                        value, size, cost = dependency_entry
+                        self._prioritize(dependency, size, cost)
+        removed = 1
+        for dependent in self.dependents.pop(key, ()):
+            removed += self.discard(dependent)
+        return removed
+
+    def _prioritize(self, key, size, cost):
+        priority = self.inflation + float(cost) / max(size, 1)
+        self.priorities[key] = priority
+        heapq.heappush(self.heap, (priority, key))
+        # superseded items are otherwise only dropped when popped by an
+        # eviction, so rebuild the heap before they outnumber the entries
+        if len(self.heap) > 2 * len(self.priorities) + 64:
+            self.heap = [(priority, key) for key, priority in self.priorities.iteritems()]
+            heapq.heapify(self.heap)
+
+    def _evict(self):
+        if self.policy == 'lru':
+            key = next(iter(self.entries))
+        else:
+            # skip heap items superseded by a later priority or removal
+            while True:
+                priority, key = heapq.heappop(self.heap)
+                if self.priorities.get(key) == priority:
+                    break
+            self.inflation = priority
+        self.evictions += self.discard(key)
+
+    def hit_rate(self):
+        """Return the fraction of get calls which found their key."""
+        lookups = self.hits + self.misses
+        return float(self.hits) / lookups if lookups else 0.0
+
+    def stats(self):
+        return {'entries': len(self), 'bytes': self.bytes,
+                'max_bytes': self.max_bytes, 'hits': self.hits,
+                'misses': self.misses, 'evictions': self.evictions,
+                'hit_rate': self.hit_rate()}
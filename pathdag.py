@@ -0,0 +1,112 @@
+import collections
+import sys
+
+
+class PathDAG(object):
+    """
+    The paths from node following a metapath, stored with shared suffixes.
+    branches is a tuple of (edge, tail) pairs where tail is the PathDAG of
+    the paths from edge.target following the rest of the metapath, which
+    is shared by every PathDAG reaching edge.target at that point. A path
+    through a tail must not revisit the nodes preceding the tail, other
+    than as consecutive repeats, so this condition is applied while
+    iterating and counting rather than by copying tails. The leaf PathDAG,
+    with branches of None, holds the single empty path.
+    """
+
+    __slots__ = ('node', 'branches', 'count')
+
+    def __init__(self, node, branches):
+        self.node = node
+        self.branches = branches
+        self.count = self.count_avoiding(())
+
+    def count_avoiding(self, avoid):
+        """Count the paths whose edge targets are not in the tuple avoid."""
+        branches = self.branches
+        if branches is None:
+            return 1
+        avoid_tail = avoid + (self.node, )
+        count = 0
+        for edge, tail in branches:
+            if edge.target in avoid:
+                continue
+            if tail.branches is None:
+                count += 1
+            else:
+                count += tail.count_avoiding(avoid_tail)
+        return count
+
+    def iter_avoiding(self, avoid):
+        """Iterate over the paths, as tuples of Edges, which avoid avoid."""
+        if self.branches is None:
+            yield ()
+            return
+        avoid_tail = avoid + (self.node, )
+        for edge, tail in self.branches:
+            if edge.target in avoid:
+                continue
+            if tail.branches is None:
+                yield edge,
+                continue
+            for suffix in tail.iter_avoiding(avoid_tail):
+                yield (edge, ) + suffix
+
+    def __iter__(self):
+        return self.iter_avoiding(())
+
+    def __len__(self):
+        return self.count
+
+    def __nonzero__(self):
+        return self.count > 0
+
+    def estimate_size(self):
+        """
+        Estimate the bytes held by this PathDAG alone. Tails are separate
+        PathDAGs and nodes and edges belong to the graph, so they are not
+        counted.
+        """
+        size = sys.getsizeof(self)
+        if self.branches is not None:
+            size += sys.getsizeof(self.branches)
+            size += len(self.branches) * sys.getsizeof((None, None))
+        return size
+
+    def estimate_total_size(self):
+        """
+        Estimate the bytes held by this PathDAG and the distinct PathDAGs
+        reachable through its tails, such as the private tails built by
+        from_paths.
+        """
+        size = 0
+        seen = set()
+        stack = [self]
+        while stack:
+            dag = stack.pop()
+            if id(dag) in seen or dag.branches is None:
+                continue
+            seen.add(id(dag))
+            size += dag.estimate_size()
+            stack.extend(tail for edge, tail in dag.branches)
+        return size
+
+    @staticmethod
+    def from_paths(node, paths):
+        """
+        Build a PathDAG from paths, a sequence of equal-length tuples of
+        Edges starting at node. Tails are grouped by shared prefix, so
+        suffixes are not shared with other PathDAGs.
+        """
+        if not paths or not paths[0]:
+            return leaf if paths else PathDAG(node, ())
+        tails = collections.OrderedDict()
+        for path in paths:
+            tails.setdefault(path[0], list()).append(path[1:])
+        branches = tuple((edge, PathDAG.from_paths(edge.target, edge_tails))
+                         for edge, edge_tails in tails.iteritems())
+        return PathDAG(node, branches)
+
+
+# the PathDAG holding the single empty path
+leaf = PathDAG(None, None)
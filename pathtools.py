@@ -1,23 +1,56 @@
 import resource
 import sys
-import collections
-import itertools
 import random
 import operator
-import gc
+import math
 import os
+import time
+
+import numpy
 
 import hetnet
+import diskcache
+import instrumentation
+import pathcache
+import pathdag
+
+
+# Cache of computed paths and DWPCs with a budget of estimated bytes
+cache = pathcache.PathCache(max_bytes=60 * 2 ** 30)
 
+# Opt-in timing and counters, enabled by setting instruments.enabled
+instruments = instrumentation.instruments
 
-cache_gets = 0
-cache_sets = 0
-i_memcheck = 0
-max_MB = 60 * 1024
-prune_fraction = 0.2
-memcheck_interval = 1000
-cache = collections.OrderedDict()
+# Optional persistent second level behind cache, set by use_disk_cache
+disk_cache = None
+
+# dtype of the dwpcs_from results stored in disk_cache
+dwpcs_dtype = numpy.dtype([('target', numpy.int64), ('count', numpy.int64), ('dwpc', numpy.float64)])
+
+def exponent_array(damping_exponent):
+    """
+    DWPC functions accept a sequence of damping exponents, computing a
+    DWPC for each in the same traversal. Return such a sequence as a float
+    array, or None for a single exponent (or None).
+    """
+    if damping_exponent is None or numpy.isscalar(damping_exponent):
+        return None
+    return numpy.array(damping_exponent, dtype=numpy.float64)
+
+def _log_degree(degree):
+    """
+    Return the log of degree for summing the degrees of a path, or -inf for
+    a zero degree, which leaves the DWPC undefined only for paths using it.
+    """
+    return math.log(degree) if degree else float('-inf')
 
+def _check_log_degrees(log_degrees):
+    """
+    Raise ZeroDivisionError, as DWPCs of a single damping exponent do, if any
+    of the summed log_degrees includes a zero degree.
+    """
+    if numpy.isneginf(log_degrees).any():
+        raise ZeroDivisionError('a path has a zero degree')
 
 
 # Set memory_usage to a function that returns memory usage in MB.
@@ -32,7 +65,7 @@ try:
         """
         # return the memory usage in MB
         process = psutil.Process(os.getpid())
-        mem = process.get_memory_info()[0] / float(2 ** 20)
+        mem = process.memory_info()[0] / float(2 ** 20)
         return mem
 
     memory_usage = memory_usage_psutil
@@ -50,75 +83,93 @@ except ImportError:
     memory_usage = memory_usage_ps
 
 
-def cache_get(key):
-    global cache_gets
-    cache_gets += 1
-    value = cache.pop(key)
-    cache[key] = value
-    return value
-
-def cache_set(key, value):
-    cache[key] = value
-    global cache_sets
-    global i_memcheck
-    cache_sets += 1
-    if i_memcheck < memcheck_interval:
-        i_memcheck += 1
-        return
-    i_memcheck = 0
-    if memory_usage() > max_MB:
-        n_remove = int(len(cache) * prune_fraction)
-        remove_keys = tuple(itertools.islice(cache.iterkeys(), n_remove))
-        for key in remove_keys:
-            del cache[key]
-        gc.collect()
-        memory = memory_usage()
-        hitrate = cache_hit_rate()
-        print_str = 'Deleted {} cached items. Using {:.1f}GB for {:.2f} item cache. Hitrate {:.5f}'
-        print(print_str.format(n_remove, memory / 1024.0, len(cache), hitrate))
+def use_disk_cache(directory, graph):
+    """
+    Store crdfs_paths_from and dwpcs_from results for graph in a DiskCache
+    in directory, which is consulted when cache misses. Results persist
+    across runs over the same graph and can be shared by processes.
+    """
+    global disk_cache
+    disk_cache = diskcache.DiskCache(directory, diskcache.graph_fingerprint(graph))
+    return disk_cache
 
+def _disk_key(name, node, metapath, *args):
+    return (name, node.id_, tuple(metaedge.get_id() for metaedge in metapath)) + args
 
 def cache_hit_rate():
     """
     Returns the cache hit rate, which is the percent of lookups
     that succeed (where the result is cached).
     """
-    return float(cache_gets) / (cache_sets + cache_gets)
+    return cache.hit_rate()
 
 
 def crdfs_paths_from(node, metapath):
     """
     Cached recursive depth-first-search: computes all paths from
     source_node of kind metapath. Paths with duplicate nodes are excluded.
-    Returns a tuple of tuple paths where the elements of the tuple path are
-    hetnet.Edge() objects. Refer to the cache_get and cache_set functions for
-    the specifics of the caching algorithm.
+    Returns a PathDAG, which iterates over tuple paths where the elements
+    of the tuple path are hetnet.Edge() objects and whose len is the number
+    of paths. The PathDAG of a node refers to the cached PathDAGs of its
+    neighbors rather than copying their paths. Results are stored in cache,
+    a PathCache which evicts results to stay within its byte budget, and for
+    metapaths of length two or more in disk_cache as arrays of edge int_ids.
+    A cached PathDAG depends on the cached PathDAGs of its tails, so that
+    evicting a tail evicts the PathDAGs which would keep it alive.
     """
     if not metapath:
-        return tuple(),
+        return pathdag.leaf
     args = node, metapath
-    if args in cache:
-        return cache_get(args)
-    paths = list()
+    paths = cache.get(args)
+    if paths is not None:
+        if instruments.enabled:
+            instruments.count('crdfs_paths_from', metapath, 'cache hits')
+        return paths
+    time_start = time.time()
+    use_disk = disk_cache is not None and len(metapath) > 1
+    if use_disk:
+        disk_key = _disk_key('crdfs_paths_from', node, metapath)
+        edge_ids = disk_cache.get(disk_key)
+        if edge_ids is not None:
+            edge_list = node.graph.edge_list
+            paths = [tuple(edge_list[i] for i in row) for row in edge_ids.tolist()]
+            paths = pathdag.PathDAG.from_paths(node, paths)
+            # the tails of paths are its own, so they are charged to it
+            cache.set(args, paths, time.time() - time_start, size=paths.estimate_total_size())
+            if instruments.enabled:
+                instruments.count('crdfs_paths_from', metapath, 'disk hits')
+            return paths
+    branches = list()
     metapath_tail = metapath.sub
     for edge in node.edges[metapath[0]]:
-        for tail in crdfs_paths_from(edge.target, metapath_tail):
-            if node in (e.target for e in tail):
-                continue
-            paths.append((edge, ) + tail)
-    paths = tuple(paths)
-    cache_set(args, paths)
+        tail = crdfs_paths_from(edge.target, metapath_tail)
+        if tail:
+            branches.append((edge, tail))
+    paths = pathdag.PathDAG(node, tuple(branches))
+    seconds = time.time() - time_start
+    # paths references its tails, so it is only cached while they are
+    depends = {(edge.target, metapath_tail) for edge, tail in branches} if metapath_tail else ()
+    cache.set(args, paths, seconds, depends)
+    if use_disk:
+        edge_ids = numpy.array([[edge.int_id for edge in path] for path in paths], dtype=numpy.int32)
+        disk_cache.set(disk_key, edge_ids.reshape(len(paths), len(metapath)))
+    if instruments.enabled:
+        instruments.record('crdfs_paths_from', metapath, seconds, node)
+        instruments.count('crdfs_paths_from', metapath, 'cache misses')
+        instruments.count('crdfs_paths_from', metapath, 'paths', len(paths))
     return paths
 
 def filtered_crdfs_paths_from(node, metapath, exclude_masked=False,
                               exclude_nodes=set(), exclude_edges=set()):
+    edge_lists = tuple(crdfs_paths_from(node, metapath))
+    masked = node.graph.paths_masked(edge_lists) if exclude_masked else None
     paths = list()
-    for edge_list in crdfs_paths_from(node, metapath):
+    for i, edge_list in enumerate(edge_lists):
         if exclude_edges and exclude_edges & set(edge_list):
             continue
-        path = hetnet.Path(edge_list)
-        if exclude_masked and path.is_masked():
+        if masked is not None and masked[i]:
             continue
+        path = hetnet.Path(edge_list)
         if exclude_nodes and exclude_nodes & set(path.get_nodes()):
             continue
         paths.append(path)
@@ -131,6 +182,7 @@ def crdfs_paths_fromto(source_node, target_node, metapath, exclude_nodes=set(),
     nodes, with nodes in exclude_nodes, or edges in exclude_edges are excluded.
     Returns of tuple of hetnet.Path() objects.
     """
+    time_start = time.time()
     paths = list()
     for edge_list in crdfs_paths_from(source_node, metapath):
         if edge_list[-1].target != target_node:
@@ -141,10 +193,89 @@ def crdfs_paths_fromto(source_node, target_node, metapath, exclude_nodes=set(),
         if exclude_nodes and exclude_nodes & set(path.get_nodes()):
             continue
         paths.append(path)
+    if instruments.enabled:
+        instruments.record('crdfs_paths_fromto', metapath, time.time() - time_start, source_node)
+        instruments.count('crdfs_paths_fromto', metapath, 'paths', len(paths))
     return tuple(paths)
 
 
 
+def _walk_crdfs(node, metapath, step, value, exclude_nodes=set(), exclude_edges=set(),
+                accept=None):
+    """
+    Iterative depth-first search over the paths from node following
+    metapath, the traversal shared by the uncached path functions. Duplicate
+    nodes are excluded as in crdfs_paths_from: a node may only repeat
+    consecutively. Paths with nodes in exclude_nodes, edges in exclude_edges
+    or edges for which accept(edge) is False are excluded.
+
+    Each path carries a value, starting from value and extended by
+    step(value, edge) for each of its edges, and the (last edge, value) of
+    every path is yielded. The nodes on the current path are counted in
+    visited, so each extension is checked in constant time rather than by
+    scanning the path.
+    """
+    length = len(metapath)
+    if not length or node in exclude_nodes:
+        return
+    nodes = [node] + [None] * length
+    values = [value] + [None] * length
+    visited = {node: 1}
+    iterators = [None] * length
+    iterators[0] = iter(node.edges[metapath[0]])
+    depth = 0
+    while depth >= 0:
+        node = nodes[depth]
+        for edge in iterators[depth]:
+            target = edge.target
+            n_visits = visited.get(target, 0)
+            if n_visits and (n_visits > 1 or target is not node):
+                continue
+            if target in exclude_nodes or edge in exclude_edges:
+                continue
+            if accept is not None and not accept(edge):
+                continue
+            value = step(values[depth], edge)
+            if depth + 1 == length:
+                yield edge, value
+                continue
+            depth += 1
+            nodes[depth] = target
+            values[depth] = value
+            visited[target] = n_visits + 1
+            iterators[depth] = iter(target.edges[metapath[depth]])
+            break
+        else:
+            # the current node is exhausted, so remove it from the path
+            if depth:
+                n_visits = visited[node] - 1
+                if n_visits:
+                    visited[node] = n_visits
+                else:
+                    del visited[node]
+            depth -= 1
+
+def iter_crdfs_paths(node, metapath, exclude_nodes=set(), exclude_edges=set()):
+    """
+    Uncached equivalent of crdfs_paths_fromto without a target: yields the
+    paths from node following metapath as tuples of hetnet.Edge() objects,
+    excluding duplicate nodes, nodes in exclude_nodes and edges in
+    exclude_edges. Nothing is cached, which suits metapaths too long to
+    cache.
+    """
+    if not metapath:
+        yield ()
+        return
+    for edge, path in _walk_crdfs(node, metapath, _extend_path, (), exclude_nodes, exclude_edges):
+        yield path
+
+def _extend_path(path, edge):
+    return path + (edge, )
+
+def _no_step(value, edge):
+    return value
+
+
 def rdfs_paths_from(node, metapath):
     """
     CAUTION: SLOW NOT CACHED
@@ -204,17 +335,25 @@ def path_based_features(source_node, target_node, metapath, exclude_masked=False
     return {'source_target': paths_st, 'from_source': paths_s, 'from_target': paths_t}
 
 
-def path_degree_product(path, damping_exponent, exclude_edges=set(), exclude_masked=True):
-    """ """
+def path_degree_product(path, damping_exponent, exclude_edges=set(), exclude_masked=True,
+                        adjustments=None):
+    """
+    Degrees are read from the graph's DegreeIndex. Excluded edges are
+    subtracted using adjustments from DegreeIndex.adjustments, which are
+    computed from exclude_edges when not provided.
+    """
+    degree_index = path[0].source.graph.degree_index
+    if adjustments is None:
+        adjustments = degree_index.adjustments(exclude_edges, exclude_masked) if exclude_edges else dict()
+    degree = degree_index.degree
     degrees = list()
     for edge in path:
-        source_edges = edge.source.get_edges(edge.metaedge, exclude_masked)
-        target_edges = edge.target.get_edges(edge.metaedge.inverse, exclude_masked)
-        if exclude_edges:
-            source_edges -= exclude_edges
-            target_edges -= exclude_edges
-        source_degree = len(source_edges)
-        target_degree = len(target_edges)
+        metaedge = edge.metaedge
+        source_degree = degree(edge.source, metaedge, exclude_masked)
+        target_degree = degree(edge.target, metaedge.inverse, exclude_masked)
+        if adjustments:
+            source_degree -= adjustments.get((edge.source, metaedge), 0)
+            target_degree -= adjustments.get((edge.target, metaedge.inverse), 0)
         degrees.append(source_degree)
         degrees.append(target_degree)
 
@@ -223,10 +362,76 @@ def path_degree_product(path, damping_exponent, exclude_edges=set(), exclude_mas
     return degree_product
 
 
+def path_degree_products(paths, damping_exponent, exclude_edges=set(), exclude_masked=True,
+                         adjustments=None):
+    """
+    Batched path_degree_product for paths following the same metapath.
+    The degrees of the paths are packed into an integer array of lookups
+    into the distinct (node, metaedge) degrees, which are read from the
+    DegreeIndex once each, and the damped products of every path are
+    computed by NumPy. Returns an array of degree products, with a column
+    per exponent for a sequence of damping exponents. A zero degree gives a
+    product of zero, as in path_degree_product.
+    """
+    exponents = exponent_array(damping_exponent)
+    if not paths:
+        return numpy.zeros((0, ) if exponents is None else (0, len(exponents)))
+    metaedges = [edge.metaedge for edge in paths[0]]
+    degree_index = paths[0][0].source.graph.degree_index
+    if adjustments is None:
+        adjustments = degree_index.adjustments(exclude_edges, exclude_masked) if exclude_edges else dict()
+
+    # int_ids of the nodes at each end of each edge, by path
+    node_ids = numpy.array([[node.int_id for edge in path for node in (edge.source, edge.target)]
+                            for path in paths], dtype=numpy.int64)
+    node_list = paths[0][0].source.graph.node_list
+    lookups = numpy.empty(node_ids.shape, dtype=numpy.int64)
+    degrees = list()
+    for column in range(2 * len(metaedges)):
+        # source degrees in even columns, target degrees in odd columns
+        position, is_target = divmod(column, 2)
+        metaedge = metaedges[position].inverse if is_target else metaedges[position]
+        unique_ids, inverse = numpy.unique(node_ids[:, column], return_inverse=True)
+        lookups[:, column] = inverse + len(degrees)
+        for int_id in unique_ids.tolist():
+            node = node_list[int_id]
+            degree = degree_index.degree(node, metaedge, exclude_masked)
+            if adjustments:
+                degree -= adjustments.get((node, metaedge), 0)
+            degrees.append(degree)
+    degrees = numpy.array(degrees, dtype=numpy.float64)
+
+    if exponents is None:
+        return (degrees ** damping_exponent)[lookups].prod(axis=1)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        log_degrees = numpy.log(degrees)[lookups].sum(axis=1)
+        products = numpy.exp(numpy.outer(log_degrees, exponents))
+    # a zero degree raised to a zero exponent, which is -inf * 0 in logs
+    products[numpy.isnan(products)] = 1.0
+    return products
+
+
 def degree_weighted_path_count(paths, damping_exponent, exclude_edges=set(), exclude_masked=True):
-    degree_products = (path_degree_product(path, damping_exponent, exclude_edges=exclude_edges, exclude_masked=exclude_masked) for path in paths)
-    path_weights = (1.0 / degree_product for degree_product in degree_products)
-    dwpc = sum(path_weights)
+    """
+    Sum the inverse degree products of paths, which must follow the same
+    metapath, computed in one batch by path_degree_products. Raises
+    ZeroDivisionError if a path has a degree product of zero.
+    """
+    exponents = exponent_array(damping_exponent)
+    if not paths:
+        return 0 if exponents is None else numpy.zeros(len(exponents))
+    time_start = time.time()
+    graph = paths[0][0].source.graph
+    degree_products = path_degree_products(paths, damping_exponent, exclude_edges, exclude_masked)
+    if not degree_products.all():
+        raise ZeroDivisionError('float division by zero')
+    dwpc = (1.0 / degree_products).sum(axis=0)
+    if exponents is None:
+        dwpc = float(dwpc)
+    if instruments.enabled:
+        metapath = graph.metagraph.get_metapath(tuple(edge.metaedge for edge in paths[0]))
+        instruments.record('degree_weighted_path_count', metapath, time.time() - time_start)
+        instruments.count('degree_weighted_path_count', metapath, 'paths', len(paths))
     return dwpc
 
 def normalized_path_count(paths_s, paths_t):
@@ -240,3 +445,402 @@ def normalized_path_count(paths_s, paths_t):
         return 2.0 * len(paths) / denom
     else:
         return None
+
+def path_metrics(source_node, target_node, metapath, damping_exponent=None,
+                 exclude_nodes=set(), exclude_edges=set(), exclude_masked=False,
+                 degree_products=False):
+    """
+    Compute the path-based features of source_node and target_node for
+    metapath without creating paths. Returns a dictionary where items store:
+    -- 'PC': the number of paths between the source and target node
+    -- 'PC_s': the number of paths from the source
+    -- 'PC_t': the number of paths from the target following metapath.inverse
+    -- 'NPC': the normalized path count, as in normalized_path_count
+    -- 'DWPC': the degree-weighted path count, None if damping_exponent is None
+    -- 'PDP': the degree products of the paths between the source and
+       target node, when degree_products is True and damping_exponent is set
+    For a sequence of damping exponents, the DWPC is an array with a value
+    per exponent and PDP an array with a row per path and a column per
+    exponent, as returned by path_degree_products.
+    A single depth-first search from source_node, by _walk_crdfs, yields
+    PC_s and every metric of the paths reaching target_node, and
+    PC_t is counted from target_node by _aggregate_paths. Paths are filtered
+    as in path_based_features, and exclude_masked also excludes masked edges
+    from degrees as in degree_weighted_path_count.
+    """
+    length = len(metapath)
+    graph = source_node.graph
+    check_masks = exclude_masked and graph.has_masked()
+    node_mask, edge_mask = graph.node_mask, graph.edge_mask
+    metrics = {'PC': 0, 'PC_s': 0, 'PC_t': 0, 'NPC': None, 'DWPC': None, 'PDP': None}
+    weighted = damping_exponent is not None
+    exponents = exponent_array(damping_exponent)
+    if weighted:
+        if exponents is None:
+            metrics['DWPC'] = 0.0
+            if degree_products:
+                metrics['PDP'] = list()
+        else:
+            metrics['DWPC'] = numpy.zeros(len(exponents))
+            if degree_products:
+                metrics['PDP'] = numpy.zeros((0, len(exponents)))
+    if not length:
+        return metrics
+    time_start = time.time()
+
+    degree_index = graph.degree_index
+    adjustments = degree_index.adjustments(exclude_edges, exclude_masked) if exclude_edges else dict()
+    degrees = dict()
+    def degree(node, metaedge):
+        key = node, metaedge
+        try:
+            return degrees[key]
+        except KeyError:
+            degree = degree_index.degree(node, metaedge, exclude_masked)
+            if adjustments:
+                degree -= adjustments.get(key, 0)
+            if exponents is None:
+                degree = degree ** damping_exponent
+            else:
+                degree = _log_degree(degree)
+            degrees[key] = degree
+            return degree
+
+    # paths carry their degree product, or for several exponents their log degree sum
+    if exponents is None:
+        def step(product, edge):
+            metaedge = edge.metaedge
+            return product * degree(edge.source, metaedge) * degree(edge.target, metaedge.inverse)
+    else:
+        def step(log_degree, edge):
+            metaedge = edge.metaedge
+            return log_degree + degree(edge.source, metaedge) + degree(edge.target, metaedge.inverse)
+    accept = None
+    if check_masks:
+        def accept(edge):
+            return edge.int_id not in edge_mask and edge.target.int_id not in node_mask
+
+    if not (check_masks and source_node.int_id in node_mask):
+        count_from = count_between = 0
+        products = list()
+        initial = 1.0 if exponents is None else 0.0
+        for edge, product in _walk_crdfs(source_node, metapath, step if weighted else _no_step, initial,
+                                         exclude_nodes, exclude_edges, accept):
+            count_from += 1
+            if edge.target is not target_node:
+                continue
+            count_between += 1
+            if weighted:
+                products.append(product)
+        metrics['PC_s'] = count_from
+        metrics['PC'] = count_between
+        if weighted and exponents is None:
+            metrics['DWPC'] = sum(1.0 / product for product in products)
+            if degree_products:
+                metrics['PDP'] = products
+        elif weighted and products:
+            products = numpy.array(products)
+            _check_log_degrees(products)
+            products = numpy.exp(numpy.outer(products, exponents))
+            metrics['DWPC'] = (1.0 / products).sum(axis=0)
+            if degree_products:
+                metrics['PDP'] = products
+
+    if check_masks:
+        metrics['PC_t'] = len(filtered_crdfs_paths_from(target_node, metapath.inverse, exclude_masked,
+                                                        exclude_nodes, exclude_edges))
+    else:
+        metrics['PC_t'] = _aggregate_paths(target_node, None, metapath.inverse,
+                                           exclude_nodes=exclude_nodes, exclude_edges=exclude_edges)[0]
+    denom = metrics['PC_s'] + metrics['PC_t']
+    if denom:
+        metrics['NPC'] = 2.0 * metrics['PC'] / denom
+    if instruments.enabled:
+        instruments.record('path_metrics', metapath, time.time() - time_start, source_node)
+        instruments.count('path_metrics', metapath, 'paths', metrics['PC_s'])
+    return metrics
+
+def _relevant_positions(kinds):
+    """
+    For each depth of a metapath with node kinds, return the positions before
+    that depth whose nodes later nodes must not duplicate.
+    """
+    length = len(kinds) - 1
+    return [tuple(k for k in range(depth) if any(
+            kinds[j] == kinds[k] for j in range(max(depth + 1, k + 2), length + 1)))
+            for depth in range(length + 1)]
+
+def _aggregate_paths(source_node, target_node, metapath, damping_exponent=None,
+                     exclude_nodes=set(), exclude_edges=set(), exclude_masked=True):
+    """
+    Aggregate the paths from source_node following metapath, without
+    creating them, by dynamic programming over the metapath. Returns a
+    (path count, DWPC) tuple where the DWPC is None if damping_exponent is
+    None. Paths are restricted to those ending on target_node unless
+    target_node is None. Paths with duplicate nodes, nodes in exclude_nodes
+    or edges in exclude_edges are excluded, matching crdfs_paths_fromto. Degrees
+    are computed as in path_degree_product. For a sequence of damping
+    exponents the DWPC is an array with one value per exponent.
+
+    The aggregate for the remainder of a path depends only on the current
+    node and on those earlier nodes which later nodes must not duplicate, so
+    it is memoized on these nodes.
+    """
+    exponents = exponent_array(damping_exponent)
+    if exponents is not None:
+        damping_exponent = exponents
+    if source_node in exclude_nodes:
+        return 0, (damping_exponent * 0.0 if damping_exponent is not None else None)
+    time_start = time.time()
+    length = len(metapath)
+    kinds = [metapath[0].source] + [metaedge.target for metaedge in metapath]
+
+    relevant = _relevant_positions(kinds)
+
+    # the edges of the final metaedge which terminate on target_node
+    last_edges = None
+    if target_node is not None:
+        last_edges = dict()
+        for edge in target_node.edges[metapath[-1].inverse]:
+            last_edges.setdefault(edge.target, list()).append(edge.inverse)
+
+    degree_index = source_node.graph.degree_index
+    adjustments = degree_index.adjustments(exclude_edges, exclude_masked) if exclude_edges else dict()
+    def degree(node, metaedge):
+        degree = degree_index.degree(node, metaedge, exclude_masked)
+        return degree - adjustments.get((node, metaedge), 0) if adjustments else degree
+
+    memo = dict()
+    def aggregate(nodes):
+        depth = len(nodes) - 1
+        if depth == length:
+            return 1, 1.0
+        node = nodes[-1]
+        key = (node, depth) + tuple(nodes[k] for k in relevant[depth])
+        try:
+            return memo[key]
+        except KeyError:
+            pass
+        metaedge = metapath[depth]
+        if last_edges is not None and depth + 1 == length:
+            edges = last_edges.get(node, ())
+        else:
+            edges = node.edges[metaedge]
+        count, weight = 0, 0.0
+        for edge in edges:
+            edge_target = edge.target
+            if edge_target in nodes[:-1]:
+                continue
+            if edge_target in exclude_nodes or edge in exclude_edges:
+                continue
+            tail_count, tail_weight = aggregate(nodes + (edge_target, ))
+            if not tail_count:
+                continue
+            count += tail_count
+            if damping_exponent is not None:
+                degree_product = (degree(node, metaedge) ** damping_exponent *
+                                  degree(edge_target, metaedge.inverse) ** damping_exponent)
+                weight += tail_weight / degree_product
+        memo[key] = count, weight
+        return count, weight
+
+    count, weight = aggregate((source_node, ))
+    if instruments.enabled:
+        instruments.record('aggregate_paths', metapath, time.time() - time_start, source_node)
+        instruments.count('aggregate_paths', metapath, 'memoized prefixes', len(memo))
+    if damping_exponent is None:
+        return count, None
+    if exponents is not None and not count:
+        weight = numpy.zeros(len(exponents))
+    return count, weight
+
+def count_paths_from(node, metapath, exclude_nodes=set(), exclude_edges=set()):
+    """
+    Count the paths from node following metapath without creating them.
+    Equivalent to len(filtered_crdfs_paths_from(...)) without masking.
+    """
+    count, dwpc = _aggregate_paths(node, None, metapath,
+                                   exclude_nodes=exclude_nodes, exclude_edges=exclude_edges)
+    return count
+
+def count_paths_between(source_node, target_node, metapath,
+                        exclude_nodes=set(), exclude_edges=set()):
+    """
+    Count the paths from source_node to target_node following metapath
+    without creating them. Equivalent to len(crdfs_paths_fromto(...)).
+    """
+    count, dwpc = _aggregate_paths(source_node, target_node, metapath,
+                                   exclude_nodes=exclude_nodes, exclude_edges=exclude_edges)
+    return count
+
+def dwpc_between(source_node, target_node, metapath, damping_exponent,
+                 exclude_nodes=set(), exclude_edges=set(), exclude_masked=True):
+    """
+    Compute the degree-weighted path count between source_node and
+    target_node without creating paths. Equivalent to applying
+    degree_weighted_path_count to crdfs_paths_fromto.
+    """
+    count, dwpc = _aggregate_paths(source_node, target_node, metapath, damping_exponent,
+                                   exclude_nodes, exclude_edges, exclude_masked)
+    return dwpc
+
+def _aggregate_paths_by_target(source_node, metapath, damping_exponent):
+    """
+    Aggregate the paths from source_node following metapath to every
+    target at once. Returns a dict of target node to (path count, DWPC),
+    where each value equals _aggregate_paths(source_node, target, ...)
+    without exclusions. Uses the depth-first search of _walk_crdfs, which
+    accumulates each path's weight as it is extended, so long metapaths
+    need no per-node merging of results.
+
+    For a sequence of damping exponents, each path instead carries the sum
+    of its log degrees, and the DWPCs of every exponent are evaluated from
+    these sums in one vectorized step per target.
+    """
+    length = len(metapath)
+    exponents = exponent_array(damping_exponent)
+    degree_index = source_node.graph.degree_index
+    degrees = dict()
+    def degree(node, metaedge):
+        key = node, metaedge
+        try:
+            return degrees[key]
+        except KeyError:
+            degree = degree_index.degree(node, metaedge)
+            if exponents is None:
+                degree = degree ** damping_exponent
+            else:
+                degree = _log_degree(degree)
+            degrees[key] = degree
+            return degree
+
+    if exponents is None:
+        def step(weight, edge):
+            metaedge = edge.metaedge
+            return weight / (degree(edge.source, metaedge) * degree(edge.target, metaedge.inverse))
+    else:
+        def step(log_degree, edge):
+            metaedge = edge.metaedge
+            return log_degree + degree(edge.source, metaedge) + degree(edge.target, metaedge.inverse)
+
+    totals = dict()
+    if exponents is None:
+        for edge, weight in _walk_crdfs(source_node, metapath, step, 1.0):
+            target = edge.target
+            count, total = totals.get(target, (0, 0.0))
+            totals[target] = count + 1, total + weight
+    else:
+        for edge, log_degree in _walk_crdfs(source_node, metapath, step, 0.0):
+            totals.setdefault(edge.target, list()).append(log_degree)
+    if exponents is not None:
+        for target, log_degrees in totals.iteritems():
+            log_degrees = numpy.array(log_degrees)
+            _check_log_degrees(log_degrees)
+            dwpcs = numpy.exp(-numpy.outer(log_degrees, exponents)).sum(axis=0)
+            totals[target] = len(log_degrees), dwpcs
+    return totals
+
+def dwpcs_from(source_node, metapath, damping_exponent):
+    """
+    Return a dict of target node to (path count, DWPC) for the paths from
+    source_node following metapath, without exclusions. Results are cached,
+    so processing queries grouped by source_node reuses them, and in
+    disk_cache when it is set. The DWPCs depend on the masked degrees, so
+    while the graph has masks they are cached under its mask_version and
+    disk_cache, whose keys do not record masks, is skipped. For a sequence
+    of damping exponents, each DWPC is an array with one value per exponent.
+    matrix.dwpc_row computes the same values as vectors over every target
+    of a CompiledGraph, which does not record masks.
+    """
+    exponents = exponent_array(damping_exponent)
+    if exponents is not None:
+        damping_exponent = tuple(exponents.tolist())
+    graph = source_node.graph
+    masked = graph.has_masked()
+    args = 'dwpcs', source_node, metapath, damping_exponent, graph.mask_version if masked else None
+    dwpcs = cache.get(args)
+    if dwpcs is not None:
+        if instruments.enabled:
+            instruments.count('dwpcs_from', metapath, 'cache hits')
+        return dwpcs
+    time_start = time.time()
+    use_disk = disk_cache is not None and not masked
+    if use_disk:
+        disk_key = _disk_key('dwpcs_from', source_node, metapath, damping_exponent)
+        records = disk_cache.get(disk_key)
+        if records is not None:
+            node_list = graph.node_list
+            targets = records['target'].tolist()
+            counts = records['count'].tolist()
+            if exponents is None:
+                values = records['dwpc'].tolist()
+            else:
+                values = numpy.array(records['dwpc'])
+            dwpcs = {node_list[target]: (count, dwpc)
+                     for target, count, dwpc in zip(targets, counts, values)}
+            cache.set(args, dwpcs, time.time() - time_start)
+            if instruments.enabled:
+                instruments.count('dwpcs_from', metapath, 'disk hits')
+            return dwpcs
+    dwpcs = _aggregate_paths_by_target(source_node, metapath, damping_exponent)
+    seconds = time.time() - time_start
+    cache.set(args, dwpcs, seconds)
+    if use_disk:
+        dtype = dwpcs_dtype
+        if exponents is not None:
+            dtype = numpy.dtype([('target', numpy.int64), ('count', numpy.int64),
+                                 ('dwpc', numpy.float64, (len(exponents), ))])
+        records = [(target.int_id, count, dwpc) for target, (count, dwpc) in dwpcs.iteritems()]
+        disk_cache.set(disk_key, numpy.array(records, dtype=dtype))
+    if instruments.enabled:
+        instruments.record('dwpcs_from', metapath, seconds, source_node)
+        instruments.count('dwpcs_from', metapath, 'cache misses')
+        instruments.count('dwpcs_from', metapath, 'targets', len(dwpcs))
+    return dwpcs
+
+def corrected_dwpc_between(source_node, target_node, metapath, damping_exponent,
+                           exclude_edges=set()):
+    """
+    Equivalent of dwpc_between for exclude_edges which join source_node and
+    target_node, computed by correcting the cached dwpcs_from result rather
+    than traversing again. Paths cannot repeat source_node or target_node
+    except through self-loops, so for metapaths of length two or more no
+    path traverses an edge between them. Excluding such edges then only
+    lowers the degrees of the endpoints, which scales the weight of every
+    path by the same factor. Falls back to dwpc_between when this does not
+    hold (length one metapaths, self-loops or other excluded edges). The
+    cached dwpcs_from result is keyed by the graph's mask_version, so masks
+    set between calls are respected. For a sequence of damping exponents,
+    returns an array of DWPCs.
+    """
+    endpoints = {source_node, target_node}
+    first, last = metapath[0], metapath[-1].inverse
+    if (len(metapath) < 2 or
+            any(edge.source not in endpoints or edge.target not in endpoints
+                for edge in exclude_edges) or
+            any(edge.target is source_node for edge in source_node.edges[first]) or
+            any(edge.target is target_node for edge in target_node.edges[last])):
+        if instruments.enabled:
+            instruments.count('corrected_dwpc_between', metapath, 'fallbacks')
+        return dwpc_between(source_node, target_node, metapath, damping_exponent,
+                            exclude_edges=exclude_edges)
+
+    exponents = exponent_array(damping_exponent)
+    if exponents is not None:
+        damping_exponent = exponents
+    zero = 0.0 if exponents is None else numpy.zeros(len(exponents))
+    count, dwpc = dwpcs_from(source_node, metapath, damping_exponent).get(target_node, (0, zero))
+    if not count or not exclude_edges:
+        return dwpc
+    degree_index = source_node.graph.degree_index
+    adjustments = degree_index.adjustments(exclude_edges)
+    for node, metaedge in (source_node, first), (target_node, last):
+        adjustment = adjustments.get((node, metaedge), 0)
+        if not adjustment:
+            continue
+        degree = degree_index.degree(node, metaedge)
+        if degree == adjustment:
+            return zero
+        # not in place, as dwpc may be a cached array
+        dwpc = dwpc * (float(degree) ** damping_exponent / float(degree - adjustment) ** damping_exponent)
+    return dwpc
@@ -0,0 +1,159 @@
+import hetnet
+import hetnet.pathtools
+
+
+class DegreeStatistics(object):
+    """
+    Per-metaedge degree statistics of a graph used to estimate the number of
+    partial paths (the frontier) at each step of a traversal.
+    """
+
+    def __init__(self, graph):
+        self.graph = graph
+        self.metanode_to_nodes = graph.get_metanode_to_nodes()
+        self.branching_cache = dict()
+
+    def degree(self, node, metaedge):
+        return len(node.edges[metaedge])
+
+    def branching(self, previous, metaedge):
+        """
+        Expected number of metaedge edges leaving a node reached by following
+        an edge of kind previous. Nodes are weighted by the number of previous
+        edges arriving at them, so hubs count in proportion to how often a
+        traversal reaches them.
+        """
+        key = previous, metaedge
+        try:
+            return self.branching_cache[key]
+        except KeyError:
+            pass
+        arrivals, departures = 0, 0
+        for node in self.metanode_to_nodes.get(metaedge.source, list()):
+            n_arriving = len(node.edges[previous.inverse])
+            arrivals += n_arriving
+            departures += n_arriving * len(node.edges[metaedge])
+        branching = float(departures) / arrivals if arrivals else 0.0
+        self.branching_cache[key] = branching
+        return branching
+
+    def frontier_sizes(self, node, metapath):
+        """
+        Return the estimated number of partial paths from node after each
+        metaedge of metapath. The first step uses the actual degree of node.
+        """
+        sizes = list()
+        size = float(self.degree(node, metapath[0]))
+        sizes.append(size)
+        for previous, metaedge in zip(metapath, metapath[1:]):
+            size *= self.branching(previous, metaedge)
+            sizes.append(size)
+        return sizes
+
+    def n_nodes(self, metanode):
+        return len(self.metanode_to_nodes.get(metanode, list()))
+
+
+class QueryPlan(object):
+    """
+    The chosen method for retrieving the paths between source and target.
+    algorithm is one of 'forward' (depth-first from source), 'backward'
+    (depth-first from target along the inverse metapath), 'split' (meet in
+    the middle via Graph.paths_between at split_index) or 'crdfs' (filter the
+    cached pathtools.crdfs_paths_from results of source, dropping those
+    paths with self-loops which the others exclude). costs maps every
+    considered (algorithm, split_index) to its estimated cost.
+    """
+
+    def __init__(self, source, target, metapath, algorithm, split_index, cost, costs):
+        self.source = source
+        self.target = target
+        self.metapath = metapath
+        self.algorithm = algorithm
+        self.split_index = split_index
+        self.cost = cost
+        self.costs = costs
+
+    def __repr__(self):
+        return '{} {} to {}: {} split {} (estimated cost {:.1f})'.format(
+            self.metapath, self.source, self.target, self.algorithm,
+            self.split_index, self.cost)
+
+
+class QueryPlanner(object):
+    """
+    Chooses between path retrieval algorithms, and where to split the
+    metapath, using the degree statistics of the graph.
+    """
+
+    def __init__(self, graph):
+        self.graph = graph
+        self.statistics = DegreeStatistics(graph)
+
+    def plan(self, source, target, metapath, masked=True, use_cache=True):
+        """
+        Return the QueryPlan with the lowest estimated cost. The cost of a
+        traversal is the estimated number of partial paths it creates. A split
+        additionally pays for joining the two halves, estimated by assuming
+        their endpoints are spread across the nodes of the intermediary
+        metanode. When use_cache is True and pathtools already holds the paths
+        from source, reading them back costs their number. The cached paths
+        ignore masking, so they are only considered when masked is True.
+        """
+        graph = self.graph
+        if not isinstance(source, hetnet.Node):
+            source = graph.node_dict[source]
+        if not isinstance(target, hetnet.Node):
+            target = graph.node_dict[target]
+
+        length = len(metapath)
+        head_sizes = self.statistics.frontier_sizes(source, metapath)
+        tail_sizes = self.statistics.frontier_sizes(target, metapath.inverse)
+
+        costs = dict()
+        costs['forward', length] = sum(head_sizes)
+        costs['backward', 0] = sum(tail_sizes)
+        for split_index in range(1, length):
+            head_size = head_sizes[split_index - 1]
+            tail_size = tail_sizes[length - split_index - 1]
+            n_middle = self.statistics.n_nodes(metapath[split_index].source) or 1
+            cost = sum(head_sizes[:split_index]) + sum(tail_sizes[:length - split_index])
+            cost += head_size * tail_size / n_middle
+            costs['split', split_index] = cost
+        if use_cache and masked and (source, metapath) in hetnet.pathtools.cache:
+            costs['crdfs', length] = len(hetnet.pathtools.cache[source, metapath])
+
+        (algorithm, split_index), cost = min(costs.items(), key=lambda item: item[1])
+        return QueryPlan(source, target, metapath, algorithm, split_index, cost, costs)
+
+    def execute(self, plan, masked=True, exclude_nodes=set(), exclude_edges=set()):
+        """Return the list of Paths retrieved according to plan."""
+        graph = self.graph
+        source, target, metapath = plan.source, plan.target, plan.metapath
+        if plan.algorithm == 'forward':
+            return list(graph.iter_paths_between(
+                source, target, metapath, masked=masked,
+                exclude_nodes=exclude_nodes, exclude_edges=exclude_edges))
+        if plan.algorithm == 'backward':
+            paths = graph.iter_paths_between(
+                target, source, metapath.inverse, masked=masked,
+                exclude_nodes=exclude_nodes, exclude_edges=exclude_edges)
+            return [hetnet.Path(path.inverse_edges()) for path in paths]
+        if plan.algorithm == 'split':
+            return graph.paths_between(
+                source, target, metapath, masked=masked,
+                exclude_nodes=exclude_nodes, exclude_edges=exclude_edges,
+                split_index=plan.split_index)
+        if plan.algorithm == 'crdfs':
+            # crdfs paths may repeat a node through a self-loop, which the
+            # other algorithms exclude as a duplicate node
+            paths = hetnet.pathtools.crdfs_paths_fromto(
+                source, target, metapath, exclude_nodes, exclude_edges)
+            return [path for path in paths if not any(edge.source is edge.target for edge in path)]
+        raise ValueError('unknown algorithm: {}'.format(plan.algorithm))
+
+    def paths_between(self, source, target, metapath,
+                      masked=True, exclude_nodes=set(), exclude_edges=set()):
+        """Plan and execute a query for the paths between source and target."""
+        plan = self.plan(source, target, metapath, masked)
+        return self.execute(plan, masked, exclude_nodes, exclude_edges)
@@ -67,12 +67,18 @@ def graph_from_writable(writable):
     graph = hetnet.Graph(metagraph)
 
     nodes = writable['nodes']
-    for node in nodes:
-        graph.add_node(**node)
+    graph.add_nodes_from((node['id_'], node['kind'], node.get('data'))
+                         for node in nodes)
 
     edges = writable['edges']
-    for edge in edges:
-        graph.add_edge(**edge)
+    graph.add_edges_from((edge['source_id'], edge['target_id'], edge['kind'],
+                          edge['direction'], edge.get('data'))
+                         for edge in edges)
+
+    offsets = graph.degree_index.offsets
+    for node_id, metaedge_id, offset in writable.get('degree_offsets', list()):
+        metaedge = metagraph.edge_dict[tuple(metaedge_id)]
+        offsets[graph.node_dict[node_id], metaedge] = offset
     
     return graph
 
@@ -147,6 +153,7 @@ def writable_from_graph(graph, ordered=True, int_id=False):
                        graph.metagraph.get_edges(exclude_inverts=True)]
     
     nodes = list()
+    node_to_int = dict()
     for i, node in enumerate(graph.node_dict.itervalues()):
         node_as_dict = collections.OrderedDict() if ordered else dict()
         node_as_dict['id_'] = node.id_
@@ -154,7 +161,7 @@ def writable_from_graph(graph, ordered=True, int_id=False):
         node_as_dict['data'] = node.data
         if int_id:
             node_as_dict['int_id'] = i
-            node.int_id = i
+            node_to_int[node] = i
         nodes.append(node_as_dict)
 
     edges = list()
@@ -165,8 +172,8 @@ def writable_from_graph(graph, ordered=True, int_id=False):
         edge_as_dict = collections.OrderedDict(edge_items) if ordered else dict(edge_items)
         edge_as_dict['data'] = edge.data
         if int_id:
-            edge_as_dict['source_int'] = edge.source.int_id
-            edge_as_dict['target_int'] = edge.target.int_id
+            edge_as_dict['source_int'] = node_to_int[edge.source]
+            edge_as_dict['target_int'] = node_to_int[edge.target]
 
         edges.append(edge_as_dict)
 
@@ -176,6 +183,12 @@ def writable_from_graph(graph, ordered=True, int_id=False):
     writable['nodes'] = nodes
     writable['edges'] = edges
 
+    # degree offsets of a subgraph record edges absent from the graph
+    offsets = graph.degree_index.offsets
+    if offsets:
+        writable['degree_offsets'] = [[node.id_, list(metaedge.get_id()), offset]
+                                      for (node, metaedge), offset in offsets.iteritems()]
+
     return writable
 
 
@@ -0,0 +1,84 @@
+import argparse
+import os
+
+import hetnet
+import hetnet.readwrite
+
+
+def reachable_nodes(graph, sources, metapaths):
+    """
+    Return the set of nodes which can be reached from sources by following
+    metapaths. Each metapath is followed from the sources of its source
+    metanode. Every node of every path from those sources is included.
+    """
+    nodes = set(sources)
+    for metapath in metapaths:
+        frontier = {source for source in sources if source.metanode == metapath.source()}
+        for metaedge in metapath:
+            frontier = {edge.target for node in frontier for edge in node.edges[metaedge]}
+            nodes |= frontier
+    return nodes
+
+def extract_shard(graph, sources, metapaths):
+    """
+    Return the subgraph of graph needed to compute path-based features for
+    sources (Nodes or node ids) along metapaths. Degrees in the shard match
+    graph, so DWPCs computed on the shard equal those computed on graph.
+    """
+    sources = [source if isinstance(source, hetnet.Node) else graph.node_dict[source]
+               for source in sources]
+    nodes = reachable_nodes(graph, sources, metapaths)
+    return graph.subgraph(nodes)
+
+def partition_sources(sources, n_shards):
+    """Split sources into n_shards groups of near equal size, in sorted order."""
+    sources = sorted(sources)
+    return [sources[i::n_shards] for i in range(n_shards)]
+
+def make_shards(graph, sources, metapaths, n_shards):
+    """Return a list of n_shards subgraphs which together cover sources."""
+    return [extract_shard(graph, group, metapaths)
+            for group in partition_sources(sources, n_shards)]
+
+def write_shards(shards, directory):
+    """Write each shard to directory as shard-<i>.pkl.gz. Returns the paths."""
+    paths = list()
+    for i, shard in enumerate(shards):
+        path = os.path.join(directory, 'shard-{}.pkl.gz'.format(i))
+        hetnet.readwrite.write_pickle(shard, path)
+        paths.append(path)
+    return paths
+
+def feature_metapaths(graph, max_length=3):
+    """
+    Return the metapaths traversed by computefeatures.compute_features: the
+    disease-to-gene metapaths plus gene-association-disease for PC_s.
+    """
+    metapaths = graph.metagraph.extract_metapaths('gene', 'disease', max_length=max_length)
+    return [metapath.inverse for metapath in metapaths] + metapaths[:1]
+
+
+if __name__ == '__main__':
+    import computefeatures
+
+    # Write the shard of a network needed to compute one partition's features
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--network-dir', type=os.path.expanduser, default=
+        'networks/')
+    parser.add_argument('--partition-path', type=os.path.expanduser)
+    parser.add_argument('--shard-path', type=os.path.expanduser)
+    parser.add_argument('--max-length', default=3, type=int)
+    args = parser.parse_args()
+
+    graph = computefeatures.read_graph(args.network_dir)
+    part_rows = computefeatures.read_part(args.partition_path)
+    sources = set()
+    for part_row in part_rows:
+        sources.add(part_row['gene_symbol'])
+        sources.add(part_row['disease_code'])
+    metapaths = feature_metapaths(graph, args.max_length)
+    shard = extract_shard(graph, sources, metapaths)
+    print('shard has {} of {} nodes and {} of {} edges'.format(
+        len(shard.node_dict), len(graph.node_dict),
+        len(shard.edge_dict), len(graph.edge_dict)))
+    hetnet.readwrite.write_pickle(shard, args.shard_path)